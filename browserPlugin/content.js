@@ -108,7 +108,10 @@ function fillFormFields() {
     
     chrome.runtime.sendMessage({ action: 'postData', data: dataToSend }, (response) => {
         if (response.fieldValues) {
-            fillFormWithServerData(response.fieldValues);
+            // Streamed answers were already applied batch by batch.
+            if (!response.streamed) {
+                fillFormWithServerData(response.fieldValues);
+            }
             chrome.runtime.sendMessage({ action: 'formsFilled', success: true });
         } else {
             chrome.runtime.sendMessage({ action: 'formsFilled', success: false });
@@ -147,5 +150,7 @@ function fillFormWithServerData(fieldValues) {
 chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
     if (request.action === "fillForms") {
         fillFormFields();
+    } else if (request.action === "applyFieldValues") {
+        fillFormWithServerData(request.fieldValues);
     }
 });
\ No newline at end of file
@@ -153,6 +153,9 @@ function syntaxHighlight(json) {
       .then(response => response.json())
       .then(data => {
         displayChatMessage(data.response, false);
+        if (data.next_offset !== undefined) {
+          displayChatMessage(`Type "all ${data.next_offset}" to see more.`, false);
+        }
       })
       .catch(error => {
         console.error('Error:', error);
@@ -169,6 +172,27 @@ function syntaxHighlight(json) {
 
   // form filling message communication
 
+  // Calls onEvent with each JSON line of a streamed response, as the lines arrive.
+  async function readJsonLines(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    while (true) {
+      const { done, value } = await reader.read();
+      buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+      const lines = buffered.split('\n');
+      buffered = done ? '' : lines.pop();
+      for (const line of lines) {
+        if (line.trim()) {
+          onEvent(JSON.parse(line));
+        }
+      }
+      if (done) {
+        return;
+      }
+    }
+  }
+
   chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
     if (request.action === 'postData') {
         const { data } = request;
@@ -182,21 +206,38 @@ function syntaxHighlight(json) {
         const comment = document.getElementById('fillFormsComment').value;
         data['comment'] = comment;
         console.log('Data to send:', data);
-        fetch('http://localhost:8888/analyze-form', {
+        // Each batch of answers is applied as soon as the server streams it in.
+        const tabId = sender.tab.id;
+        let filledCount = 0;
+        fetch('http://localhost:8888/analyze-form/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify(data)
         })
-        .then(response => response.json())
-        .then(data => {
-            sendResponse({ fieldValues: data.fieldValues });
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Server responded with ${response.status}`);
+            }
+            return readJsonLines(response, event => {
+                if (event.fieldValues) {
+                    filledCount += event.fieldValues.length;
+                    chrome.tabs.sendMessage(tabId, { action: 'applyFieldValues', fieldValues: event.fieldValues });
+                    showStatus(`Filled ${filledCount} fields (batch ${event.batch + 1} of ${event.batches})...`);
+                }
+                if (event.error) {
+                    throw new Error(event.error);
+                }
+            });
+        })
+        .then(() => {
+            sendResponse({ fieldValues: [], streamed: true });
             showStatus('Forms filled successfully!');
         })
         .catch(error => {
             console.error('Error:', error);
-            sendResponse({ fieldValues: null });
+            sendResponse({ fieldValues: filledCount ? [] : null, streamed: true });
             showStatus('Error filling forms.', true);
         })
         .finally(() => {
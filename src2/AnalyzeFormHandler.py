@@ -1,11 +1,16 @@
 import json
 from Util import Utils
+from Packer import BatchPacker
+from Filler import BatchFiller
 
 class CompleteFormProcessor():
-    def __init__(self, openAI_client, memory_manager, form_filler, debug=False):
+    def __init__(self, openAI_client, memory_manager, form_filler, debug=False, fill_concurrency=4):
         self.memory_manager = memory_manager
         self.form_filler = form_filler
         self.client = openAI_client
+        # Form fields are classified by gpt-4o-mini in chunks packed to its budget.
+        self.packer = BatchPacker("gpt-4o-mini")
+        self.filler = BatchFiller(concurrency=fill_concurrency)
         self.pdf_cache = {}
         self.question_with_answers = []
         self.debug = debug
@@ -34,14 +39,16 @@ class CompleteFormProcessor():
         
         print('Questions formed, now filling...')
         # Step 4: Fill form
+        answers = {}
+        for batch_filled_form in self.filler.fill_all(lambda batch, timeout: self.form_filler.fill_form(batch, comment, timeout), grouped_batches):
+            answers.update(batch_filled_form or {})
+        print(self.filler.report())
+        # Update q_w_m with the answers
         filled_form = {}
-        for batch in grouped_batches:
-            batch_filled_form = self.form_filler.fill_form(batch, comment)
-            # Update q_w_m with the answers
-            for question in q_w_m:
-                if question['id'] in batch_filled_form:
-                    question['answer'] = batch_filled_form[question['id']]
-                    filled_form[question['field_name']] = question['answer']
+        for question in q_w_m:
+            if question['id'] in answers:
+                question['answer'] = answers[question['id']]
+                filled_form[question['field_name']] = question['answer']
         print(filled_form)
         return {"fieldValues": filled_form}
 
@@ -58,36 +65,19 @@ class CompleteFormProcessor():
         combined_result = self.combine_results(all_results)
         return combined_result
 
-    def create_chunks(self, form_fields, website_info, comment, url, chunk_size=2000):
-        def word_count(text: str) -> int:
-            return len(text.split())
-        chunks = []
-        current_chunk = []
-        current_size = 0
-
-        for field in form_fields:
-            field_size = word_count(json.dumps(field))
-            if current_size + field_size > chunk_size and current_chunk:
-                chunks.append({
-                    'formFields': current_chunk,
-                    'websiteOverview': website_info,
-                    'comment': comment,
-                    'url': url
-                })
-                current_chunk = []
-                current_size = 0
-            current_chunk.append(field)
-            current_size += field_size
-
-        if current_chunk:
-            chunks.append({
-                'formFields': current_chunk,
+    def create_chunks(self, form_fields, website_info, comment, url):
+        packer = self.packer
+        batches = packer.pack([(packer.count_value(field), []) for field in form_fields])
+        print(packer.report())
+        return [
+            {
+                'formFields': [form_fields[i] for i in indices],
                 'websiteOverview': website_info,
                 'comment': comment,
                 'url': url
-            })
-
-        return chunks
+            }
+            for indices, _ in batches
+        ]
 
     def process_chunk(self, chunk):
         prompt = f"""
@@ -130,7 +120,7 @@ class CompleteFormProcessor():
             ]
         )
 
-        return Utils.extractValidJson(response.choices[0].message.content)
+        return Utils.extractValidJson(response.choices[0].message.content, key="questions")
 
     def combine_results(self, results):
         combined_result = {
@@ -145,15 +135,25 @@ class CompleteFormProcessor():
         return combined_result
 
 class SimplifiedWebFormProcessor():
-    def __init__(self, openAI_client, memory_manager, form_filler, debug=False):
+    def __init__(self, openAI_client, memory_manager, form_filler, debug=False, fill_concurrency=4):
         self.memory_manager = memory_manager
         self.form_filler = form_filler
         self.client = openAI_client
+        # Fields and memories for fill_form_simple are packed into gpt-4o sized prompts.
+        self.packer = BatchPacker("gpt-4o")
+        self.filler = BatchFiller(concurrency=fill_concurrency)
         self.pdf_cache = {}
         self.question_with_answers = []
         self.debug = debug
 
     def process(self, data):
+        # Batches are filled concurrently and concatenated in batch order.
+        results = {index: batch_filled_fields for index, _, batch_filled_fields in self.iter_process(data)}
+        return [field for index in sorted(results) for field in results[index]]
+
+    def iter_process(self, data):
+        """Yields (batch index, batch count, filled fields) as each batch is filled,
+        in completion order, so a caller can pass answers on before the whole form is done."""
         form_fields = data.get('formFields', [])
         website_info = data.get('websiteOverview', {})
         comment = data.get('comment', '')
@@ -169,80 +169,54 @@ class SimplifiedWebFormProcessor():
         
         print('Fields processed, now filling...')
         # Step 3: Fill form
-        filled_fields = []
-        for batch in grouped_batches:
-            batch_filled_fields = self.fill_form_simple(batch, website_info, comment, url)
-            filled_fields.extend(batch_filled_fields)
+        fill = lambda batch, timeout: self.fill_form_simple(batch, website_info, comment, url, timeout)
+        for index, batch_filled_fields in self.filler.iter_fill(fill, grouped_batches):
+            yield index, len(grouped_batches), batch_filled_fields or []
+        print(self.filler.report())
         print("Filling complete")
-        return filled_fields
 
     def retrieve_memories_for_fields(self, fields):
         fields_with_memories = []
-        for field in fields:
-            query = f"{field['name']}"
-            memories = self.memory_manager.search_memories(query, n_results=3)
+        all_memories = self.memory_manager.hybrid_search_batch([f"{field['name']}" for field in fields], n_results=3)
+        for field, memories in zip(fields, all_memories):
             fields_with_memories.append({
                 "field": field,
                 "memories": [
                     {
-                        "id": row['id'],
-                        "content": row['document'],
-                        "metadata": row['metadata']
+                        "id": record.id,
+                        "content": record.document,
+                        "metadata": record.metadata_text()
                     }
-                    for _, row in memories.iterrows()
+                    for record in memories
                 ]
             })
         return fields_with_memories
 
-    def group_fields_and_memories(self, fields_with_memories, max_words=3000):
-        def word_count(text: str) -> int:
-            return len(text.split())
-        
-        grouped_batches = []
-        current_batch = {"fields": [], "memories": []}
-        current_word_count = 0
-        current_memory_ids = set()
-
-        for item in fields_with_memories:
-            field_words = word_count(json.dumps(item['field']))
-            
-            # Filter out duplicate memories
-            unique_memories = []
-            memory_words = 0
-            for memory in item['memories']:
-                if memory['id'] not in current_memory_ids:
-                    unique_memory = {
-                        "content": memory['content'],
-                        "metadata": memory['metadata']
-                    }
-                    unique_memories.append(unique_memory)
-                    memory_words += word_count(memory['content'])
-                    current_memory_ids.add(memory['id'])
-
-            item_words = field_words + memory_words
-
-            if current_word_count + item_words > max_words and (
-                current_batch["fields"] or current_batch["memories"]):
-                
-                grouped_batches.append(current_batch)
-                current_batch = {"fields": [], "memories": []}
-                current_word_count = 0
-                current_memory_ids.clear()
-
-            # Add the field
-            current_batch["fields"].append(item['field'])
-            
-            # Add unique memories
-            current_batch["memories"].extend(unique_memories)
-            
-            current_word_count += item_words
-
-        if current_batch["fields"] or current_batch["memories"]:
-            grouped_batches.append(current_batch)
+    def group_fields_and_memories(self, fields_with_memories):
+        packer = self.packer
+        items = [
+            (
+                packer.count_value(item['field']),
+                [(memory['id'], packer.count(memory['content']) + packer.count(memory['metadata']) + 10)
+                 for memory in item['memories']]
+            )
+            for item in fields_with_memories
+        ]
 
+        grouped_batches = []
+        for indices, memory_ids in packer.pack(items):
+            memories = {memory['id']: memory for i in indices for memory in fields_with_memories[i]['memories']}
+            grouped_batches.append({
+                "fields": [fields_with_memories[i]['field'] for i in indices],
+                "memories": [
+                    {"content": memories[memory_id]['content'], "metadata": memories[memory_id]['metadata']}
+                    for memory_id in memory_ids
+                ]
+            })
+        print(packer.report())
         return grouped_batches
 
-    def fill_form_simple(self, batch, website_info, comment, url):
+    def fill_form_simple(self, batch, website_info, comment, url, timeout=None):
         fields = batch["fields"]
         memories = batch["memories"]
         
@@ -273,16 +247,17 @@ class SimplifiedWebFormProcessor():
         Ensure that your response is a valid JSON object.
         """
         
-        response = self.client.chat.completions.create(
+        response = self.client.with_options(max_retries=0).chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are an AI assistant that fills out forms based on provided memories and context. Fill out the form fields using the given information and memories. For non-factual or creativity related fields, generate a reasonable response based on the context."},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            timeout=timeout
         )
         
         try:
-            filled_fields = Utils.extractValidJson(response.choices[0].message.content)
+            filled_fields = Utils.extractValidJson(response.choices[0].message.content, key="form")
             return filled_fields['form']
         except Exception as e:
             print(f'Error: {e}. Using an empty dictionary instead.')
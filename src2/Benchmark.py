@@ -0,0 +1,789 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from dotenv import load_dotenv
+from Util import Utils
+
+load_dotenv()
+
+class LocalEmbeddingFunction:
+    """Stand-in for OpenAIEmbeddingFunction: hashed bag-of-words vectors, with an
+    optional sleep per call to mimic the API round-trip."""
+
+    def __init__(self, api_key=None, model_name=None, dim=256, latency=0.0):
+        self.dim = dim
+        self.latency = latency
+
+    def __call__(self, input):
+        import hashlib
+        import numpy as np
+        if self.latency:
+            time.sleep(self.latency)
+        vectors = np.zeros((len(input), self.dim), dtype=np.float32)
+        for i, text in enumerate(input):
+            for word in text.lower().split():
+                vectors[i, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+        return vectors.tolist()
+
+def _offline_memory_manager(db_path, backend="chroma", embed_latency=0.0, llm_latency=0.0):
+    """A MemoryManager whose embeddings and merge decisions never leave the machine."""
+    import chromadb.utils.embedding_functions as embedding_functions
+    from Memory import MemoryManager
+
+    embedding_functions.OpenAIEmbeddingFunction = lambda api_key, model_name: LocalEmbeddingFunction(latency=embed_latency)
+    memory_manager = MemoryManager("offline", collection_name="bench", db_path=db_path,
+                                   cache_dir=os.path.join(db_path, "cache"), backend=backend)
+
+    def decide_and_merge(existing_info, existing_metadata, new_info, new_metadata):
+        if llm_latency:
+            time.sleep(llm_latency)
+        return {"merge_decision": False, "reason": "benchmark", "merged_metadata": None, "merged_information": None}
+
+    memory_manager.decide_and_merge = decide_and_merge
+    return memory_manager
+
+def bench_merge_replay(args):
+    """Replay a knowledge file (one fact per line, overview last) into a scratch
+    collection and report how many merge decisions needed the LLM."""
+    from Memory import MemoryManager
+
+    with open(args.facts) as f:
+        facts = [line.strip() for line in f if line.strip()]
+
+    db_path = tempfile.mkdtemp(prefix="bench_chroma_")
+    try:
+        memory_manager = MemoryManager(os.getenv('OPENAI_API_KEY'), collection_name="bench_replay", db_path=db_path)
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            memory_manager.add_new_facts(facts)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(db_path, ignore_errors=True)
+
+    stats = memory_manager.merge_stats
+    llm_calls = stats['llm_calls'] + stats['speculative_llm_calls']
+    decisions = llm_calls + stats['local_duplicates'] + stats['local_distinct']
+    print(f"\nReplayed {len(facts) - 1} facts x {args.rounds} rounds in {elapsed:.1f}s")
+    print(f"Merge decisions: {decisions}")
+    print(f"  LLM calls:        {stats['llm_calls']}")
+    print(f"  speculative:      {stats['speculative_llm_calls']} ({stats['speculative_unused']} unused)")
+    print(f"  local duplicates: {stats['local_duplicates']}")
+    print(f"  local distinct:   {stats['local_distinct']}")
+    if decisions:
+        print(f"LLM calls avoided: {100 * (decisions - llm_calls) / decisions:.1f}%")
+
+def bench_search_results(args):
+    """Per-query cost of turning a Chroma result into memory dicts for the form
+    fillers: the old DataFrame + iterrows path against MemoryRecord."""
+    import pandas as pd
+    from Memory import MemoryRecord
+
+    n = args.n_results
+    results = {
+        'ids': [[f"2024-01-01 00:00:00.000fact {i}" for i in range(n)]],
+        'distances': [[0.1 * i for i in range(n)]],
+        'documents': [[f"The passport number of the user issued in 2019 is X{i:07d}" for i in range(n)]],
+        'metadatas': [[{"created_at": "2024-01-01", "last_updated": "2024-01-02",
+                        "source_overview": "Passport scan, 2019"} for _ in range(n)]],
+        'embeddings': None
+    }
+
+    def format_metadata(metadata):
+        return '\n'.join([f"{k}: {v}" for k, v in metadata.items()])
+
+    def with_dataframe():
+        df = pd.DataFrame(Utils.format_chroma_results(results))
+        df['metadata'] = df['metadata'].apply(format_metadata)
+        df = df.reindex(columns=['id', 'distance', 'document', 'metadata'])
+        return [{"id": row['id'], "content": row['document'], "metadata": row['metadata']}
+                for _, row in df.iterrows()]
+
+    def with_records():
+        return [{"id": r.id, "content": r.document, "metadata": r.metadata_text()}
+                for r in MemoryRecord.from_chroma(results)]
+
+    for name, func in (("DataFrame", with_dataframe), ("MemoryRecord", with_records)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            func()
+        per_query = (time.perf_counter() - start) / args.repeat
+        print(f"{name:>12}: {per_query * 1e6:9.1f} us/query ({n} results)")
+
+def _run_timed(command, **kwargs):
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, **kwargs)
+    return time.perf_counter() - start
+
+def bench_startup(args):
+    """Cold-start cost of the server and both consoles, each in a fresh interpreter:
+    module import time, and time until the first request (server) or the first
+    command (consoles) has been answered."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env.setdefault('OPENAI_API_KEY', 'benchmark')
+    baseline = min(_run_timed([sys.executable, "-c", "pass"], env=env) for _ in range(args.repeat))
+
+    def import_time(module, path=None):
+        if path:
+            code = (f"import importlib.util; spec = importlib.util.spec_from_file_location({module!r}, {path!r}); "
+                    "spec.loader.exec_module(importlib.util.module_from_spec(spec))")
+        else:
+            code = f"import {module}"
+        return min(_run_timed([sys.executable, "-c", code], cwd=here, env=env) for _ in range(args.repeat)) - baseline
+
+    def server_first_request():
+        start = time.perf_counter()
+        server = subprocess.Popen([sys.executable, "tornado-server.py", "--port", str(args.port)],
+                                  cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    with urllib.request.urlopen(f"http://localhost:{args.port}/", timeout=1):
+                        return time.perf_counter() - start
+                except OSError:
+                    if server.poll() is not None:
+                        raise RuntimeError("server exited before answering")
+                    time.sleep(0.01)
+        finally:
+            server.terminate()
+            server.wait()
+
+    def console_first_command(script):
+        # "help" is answered, then "exit" ends the loop.
+        return min(_run_timed([sys.executable, script], cwd=here, env=env, input=b"help\nexit\n")
+                   for _ in range(args.repeat))
+
+    print(f"interpreter start: {baseline * 1000:8.1f} ms (subtracted from import times)")
+    print(f"tornado-server.py     import {import_time('server', 'tornado-server.py') * 1000:8.1f} ms"
+          f"   first request {min(server_first_request() for _ in range(args.repeat)) * 1000:8.1f} ms")
+    for module in ("KnowledgeConsole", "FormFillerConsole"):
+        print(f"{module + '.py':<21} import {import_time(module) * 1000:8.1f} ms"
+              f"   first command {console_first_command(module + '.py') * 1000:8.1f} ms")
+
+def _current_rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def bench_vector_store_run(args):
+    """Child process of vector-store: one backend at one size, result printed as JSON."""
+    import json
+    import numpy as np
+    from VectorStore import ChromaStore, NumpyStore
+
+    class NoEmbedding:
+        def __call__(self, input):
+            raise RuntimeError("the benchmark passes embeddings explicitly")
+
+    rng = np.random.default_rng(0)
+    path = tempfile.mkdtemp(prefix="bench_store_")
+    try:
+        if args.backend == "numpy":
+            store = NumpyStore(path, NoEmbedding())
+        else:
+            store = ChromaStore(path, "bench", NoEmbedding())
+        rss_before = _current_rss_mb()
+
+        chunk = 5000
+        for start in range(0, args.size, chunk):
+            n = min(chunk, args.size - start)
+            vectors = rng.standard_normal((n, args.dim), dtype=np.float32)
+            store.add(
+                ids=[f"fact-{start + i}" for i in range(n)],
+                documents=[f"fact number {start + i} about the user" for i in range(n)],
+                metadatas=[{"source_overview": "benchmark"} for _ in range(n)],
+                embeddings=vectors.tolist()
+            )
+
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32).tolist()
+        start = time.perf_counter()
+        for q in queries:
+            store.query(query_embeddings=[q], n_results=3)
+        single = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        store.query(query_embeddings=queries, n_results=3)
+        batched = time.perf_counter() - start
+
+        print(json.dumps({"single_ms": single * 1000, "batch_ms": batched * 1000,
+                          "rss_mb": _current_rss_mb() - rss_before}))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def bench_vector_store(args):
+    """Query latency and resident memory of the Chroma and NumPy backends at several
+    knowledge-base sizes, each measured in its own process."""
+    import json
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'backend':>8} {'facts':>8} {'single query':>14} {f'{args.queries} queries batched':>24} {'RSS growth':>12}")
+    for size in args.sizes:
+        for backend in ("chroma", "numpy"):
+            output = subprocess.run(
+                [sys.executable, os.path.join(here, "Benchmark.py"), "vector-store-run", "--backend", backend,
+                 "--size", str(size), "--dim", str(args.dim), "--queries", str(args.queries)],
+                check=True, capture_output=True, text=True, cwd=here
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(f"{backend:>8} {size:>8} {result['single_ms']:>11.2f} ms {result['batch_ms']:>21.2f} ms "
+                  f"{result['rss_mb']:>9.1f} MB")
+
+def bench_snapshot_load(args):
+    """Facts per second through the per-fact ingestion path against a snapshot
+    import of the same knowledge base, with local stand-ins for the OpenAI calls."""
+    import contextlib
+    import io
+
+    workdir = tempfile.mkdtemp(prefix="bench_snapshot_")
+    try:
+        source = _offline_memory_manager(os.path.join(workdir, "source"), args.backend,
+                                         args.embed_latency, args.llm_latency)
+        facts = [f"Fact {i} about the user: item {i * 7919 % 100003} recorded in year {1990 + i % 35}"
+                 for i in range(args.facts)]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for fact in facts:
+                source.add_or_update_info(fact, "benchmark document")
+        per_fact = time.perf_counter() - start
+
+        snapshot = os.path.join(workdir, "snapshot")
+        source.export_snapshot(snapshot)
+
+        target = _offline_memory_manager(os.path.join(workdir, "target"), args.backend,
+                                         args.embed_latency, args.llm_latency)
+        start = time.perf_counter()
+        loaded = target.import_snapshot(snapshot)
+        bulk = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"per-fact ingestion: {args.facts / per_fact:10.1f} facts/s ({per_fact:.2f}s)")
+    print(f"snapshot import:    {loaded / bulk:10.1f} facts/s ({bulk:.2f}s)")
+
+def _synthetic_pdf(path, pages):
+    """A text-heavy multi-page PDF drawn with Pillow, for when no real scan is given."""
+    from PIL import Image, ImageDraw
+
+    images = []
+    for page in range(pages):
+        image = Image.new("RGB", (1700, 2200), "white")
+        draw = ImageDraw.Draw(image)
+        for line in range(60):
+            draw.text((100, 100 + line * 33), f"Page {page + 1} line {line}: Name ____ Date of birth ____ Address ____",
+                      fill="black")
+        images.append(image)
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=200)
+
+def bench_pdf_pages_run(args):
+    """Child process of pdf-pages: one rasterization mode, result printed as JSON."""
+    import json
+    import resource
+    from Preprocess import Preprocessor
+
+    preprocessor = Preprocessor(batch_size=args.batch_size, render_workers=args.workers, dpi=args.dpi, cache_dir=None)
+    start = time.perf_counter()
+    first_batch = None
+    pages = 0
+    if args.mode == "eager":
+        # What process_pdf used to do: every page in memory before the first batch.
+        from pdf2image import convert_from_path
+        images = convert_from_path(args.pdf, dpi=args.dpi)
+        for i in range(0, len(images), args.batch_size):
+            if first_batch is None:
+                first_batch = time.perf_counter() - start
+            pages += len(images[i:i + args.batch_size])
+    else:
+        for images in preprocessor.iter_page_batches(args.pdf):
+            if first_batch is None:
+                first_batch = time.perf_counter() - start
+            pages += len(images)
+            del images
+    total = time.perf_counter() - start
+    print(json.dumps({"pages": pages, "first_batch_s": first_batch, "total_s": total,
+                      "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+def bench_pdf_pages(args):
+    """Time to first batch, total time and peak resident memory of rasterizing a PDF
+    all at once against the streaming page pipeline, each in its own process."""
+    import json
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix="bench_pdf_")
+    try:
+        pdf = args.pdf
+        if pdf is None:
+            pdf = os.path.join(workdir, "synthetic.pdf")
+            _synthetic_pdf(pdf, args.pages)
+        print(f"{'mode':>10} {'workers':>8} {'pages':>6} {'first batch':>12} {'total':>9} {'peak RSS':>10}")
+        for mode, workers in [("eager", 1)] + [("streaming", w) for w in args.workers]:
+            output = subprocess.run(
+                [sys.executable, os.path.join(here, "Benchmark.py"), "pdf-pages-run", pdf, "--mode", mode,
+                 "--workers", str(workers), "--dpi", str(args.dpi), "--batch-size", str(args.batch_size)],
+                check=True, capture_output=True, text=True, cwd=here
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(f"{mode:>10} {workers:>8} {result['pages']:>6} {result['first_batch_s']:>10.2f} s "
+                  f"{result['total_s']:>7.2f} s {result['peak_rss_mb']:>7.0f} MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _local_vision_endpoint(latency, fail_every=0):
+    """A chat-completions stand-in on a free local port: sleeps latency seconds per
+    request and answers every fail_every-th request with a 500. Returns the base URL
+    and the server; call shutdown() when done."""
+    import json
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    counter = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                counter["requests"] += 1
+                failing = fail_every and counter["requests"] % fail_every == 0
+            time.sleep(latency)
+            if failing:
+                self.send_response(500)
+                self.end_headers()
+                return
+            body = json.dumps({
+                "id": "local", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "Summary of the pages."}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1", server
+
+def bench_vision_batches(args):
+    """End-to-end latency of analyzing a document's page batches serially and with
+    concurrent vision calls, against a local stand-in for the OpenAI endpoint."""
+    import contextlib
+    import io
+    import json
+    from PIL import Image, ImageDraw
+    from Preprocess import Preprocessor
+
+    base_url, server = _local_vision_endpoint(args.latency, args.fail_every)
+
+    def local_vision_call(batch, comment):
+        # Same payload as process_image_batch, posted without the OpenAI client's own
+        # retries so failures reach the pipeline's retry logic.
+        payload = json.dumps({"model": "gpt-4o", "messages": [{"role": "user", "content": [
+            {"type": "text", "text": comment},
+            *[{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{Preprocessor.encode_image(image)}"}}
+              for image in batch]
+        ]}]}).encode()
+        request = urllib.request.Request(f"{base_url}/chat/completions", data=payload,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())["choices"][0]["message"]["content"]
+
+    try:
+        pages = []
+        for page in range(args.pages):
+            image = Image.new("RGB", (850, 1100), "white")
+            ImageDraw.Draw(image).text((50, 50), f"Page {page + 1}", fill="black")
+            pages.append(Preprocessor.image_to_jpeg(image))
+        batches = [pages[i:i + 3] for i in range(0, len(pages), 3)]
+
+        print(f"{args.pages} pages, {len(batches)} batches, {args.latency:.2f}s per call"
+              + (f", every {args.fail_every}th call fails" if args.fail_every else ""))
+        print(f"{'concurrency':>12} {'total':>9} {'per batch':>10}")
+        for concurrency in args.concurrency:
+            preprocessor = Preprocessor("offline", vision_concurrency=concurrency, retry_backoff=0.1, cache_dir=None)
+            start = time.perf_counter()
+            with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+                summaries = preprocessor.analyze_batches(iter(batches), "benchmark", local_vision_call, len(batches))
+            elapsed = time.perf_counter() - start
+            assert len(summaries) == len(batches)
+            print(f"{concurrency:>12} {elapsed:>7.2f} s {elapsed / len(batches) * 1000:>7.0f} ms")
+    finally:
+        server.shutdown()
+
+def _synthetic_pages():
+    """A sparse form page, a dense text page and a page with a colour photo, at 200 dpi."""
+    from PIL import Image, ImageDraw
+
+    sparse = Image.new("RGB", (1700, 2200), "white")
+    draw = ImageDraw.Draw(sparse)
+    for line in range(12):
+        draw.text((150, 200 + line * 150), f"Field {line}: Name ____________  Date ____", fill="black")
+
+    dense = Image.new("RGB", (1700, 2200), "white")
+    draw = ImageDraw.Draw(dense)
+    for line in range(200):
+        draw.text((60, 20 + line * 11), "Lorem ipsum dolor sit amet, consectetur adipiscing elit " * 4, fill="black")
+
+    color = sparse.copy()
+    draw = ImageDraw.Draw(color)
+    for y in range(600):
+        draw.line([(300, 800 + y), (1400, 800 + y)], fill=(y % 256, 120, 255 - y % 256))
+    return {"sparse": sparse, "dense": dense, "color": color}
+
+def bench_page_images(args):
+    """Bytes per page and encode time of each image profile on synthetic pages."""
+    from Preprocess import Preprocessor, IMAGE_PROFILES
+
+    pages = _synthetic_pages()
+    print(f"{'profile':>9} " + " ".join(f"{name:>16}" for name in pages) + f" {'encode':>10}")
+    for profile in ["auto"] + list(IMAGE_PROFILES):
+        preprocessor = Preprocessor(image_profile=profile, cache_dir=None)
+        sizes = []
+        for name, image in pages.items():
+            for _ in range(args.repeat):
+                buffer = preprocessor.encode_page(image)
+            chosen = Preprocessor.classify_page(image) if profile == "auto" else profile
+            sizes.append(f"{buffer.getbuffer().nbytes / 1024:6.0f} KB {chosen:>6}")
+        stats = preprocessor.image_stats
+        print(f"{profile:>9} " + " ".join(f"{size:>16}" for size in sizes)
+              + f" {stats['encode_seconds'] / stats['pages'] * 1000:>7.1f} ms")
+
+def _line_split_content(preprocessor, content, lines_per_batch=200, overlap=5):
+    """split_content as it was before token budgets, kept here as the baseline."""
+    lines = content.split('\n')
+    start_summary, main_content, end_summary = preprocessor.extract_summaries(lines)
+    page_breaks = preprocessor.find_page_breaks(main_content)
+    batches = []
+    current_batch = []
+    for i, line in enumerate(main_content):
+        if i in page_breaks:
+            if len(current_batch) >= lines_per_batch:
+                batches.append(preprocessor.create_batch(current_batch, start_summary, end_summary))
+                current_batch = []
+            elif current_batch:
+                current_batch.append(line)
+                continue
+        current_batch.append(line)
+        if len(current_batch) >= lines_per_batch:
+            next_page_break = next((pb for pb in page_breaks if pb > i), None)
+            if next_page_break is None or next_page_break - i > overlap:
+                batches.append(preprocessor.create_batch(current_batch, start_summary, end_summary))
+                current_batch = []
+    if current_batch:
+        batches.append(preprocessor.create_batch(current_batch, start_summary, end_summary))
+    return batches
+
+def bench_split_content(args):
+    """Line-count splitter against the streaming token-budget splitter on a long
+    extracted document with a page break every --page-lines lines."""
+    from Preprocess import Preprocessor
+    from Tokenizer import get_encoding
+
+    preprocessor = Preprocessor(cache_dir=None)
+    lines = ["Scanned records of the user, one residence per line.", ""]
+    for i in range(args.lines):
+        lines.append(f"Page {i // args.page_lines + 1}" if i % args.page_lines == 0
+                     else f"Line {i}: the user lived at {i} Main Street from {1990 + i % 30} to {1991 + i % 30}.")
+    content = "\n".join(lines)
+    tokenizer = "tiktoken" if get_encoding("gpt-4o") is not None else "estimate (tiktoken unavailable)"
+    print(f"{args.lines} lines, page break every {args.page_lines} lines, token counts from {tokenizer}")
+
+    start = time.perf_counter()
+    batches = _line_split_content(preprocessor, content)
+    print(f"line splitter:  {time.perf_counter() - start:8.2f} s  {len(batches)} batches")
+
+    start = time.perf_counter()
+    first = None
+    count = 0
+    for _ in preprocessor.split_content(content, max_tokens=args.max_tokens):
+        if first is None:
+            first = time.perf_counter() - start
+        count += 1
+    print(f"token splitter: {time.perf_counter() - start:8.2f} s  {count} batches, first after {first * 1000:.1f} ms")
+
+def _regex_extract_json(input_str):
+    """extractValidJson as it was before the scanner, kept here as the baseline."""
+    import json
+    import re
+    try:
+        return json.loads(input_str)
+    except json.JSONDecodeError:
+        match = re.compile(r'.*\{[\S\s]*\}').search(input_str)
+        if match:
+            try:
+                return json.loads(match.group(0))
+            except json.JSONDecodeError:
+                return None
+        return None
+
+def bench_extract_json(args):
+    """Accuracy on the corpus of malformed model outputs, a mutation fuzz run, and
+    time on long outputs, for the regex extractor and the scanner."""
+    import contextlib
+    import io
+    import json
+    import random
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, "bench_data", "malformed_json.jsonl"), encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    def scanner(case_output, key):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Utils.extractValidJson(case_output, key=key)
+
+    regex_correct = sum(_regex_extract_json(case["output"]) == case["expected"] for case in corpus)
+    scanner_failures = [case["name"] for case in corpus if scanner(case["output"], case["key"]) != case["expected"]]
+    print(f"corpus ({len(corpus)} outputs): regex {regex_correct} correct, "
+          f"scanner {len(corpus) - len(scanner_failures)} correct")
+    for name in scanner_failures:
+        print(f"  scanner mismatch: {name}")
+
+    # Mutations of corpus outputs must never raise, and prose appended after an
+    # answer must not change it.
+    rng = random.Random(args.seed)
+    noise = ['{', '}', '"', '\\', '```', '\n', ' {"x": ', 'null', ']', ',']
+    errors = changed = 0
+    for _ in range(args.fuzz):
+        case = rng.choice(corpus)
+        text = case["output"]
+        mutation = rng.randrange(3)
+        if mutation == 0:
+            text = text[:rng.randrange(len(text) + 1)]
+        elif mutation == 1:
+            position = rng.randrange(len(text) + 1)
+            text = text[:position] + rng.choice(noise) + text[position:]
+        else:
+            text = text + "\nLet me know if you need anything else" + "".join(rng.choice(noise) for _ in range(3))
+        try:
+            result = scanner(text, case["key"])
+        except Exception:
+            errors += 1
+            continue
+        if mutation == 2 and case["expected"] is not None and result != case["expected"]:
+            changed += 1
+    print(f"fuzz ({args.fuzz} mutations): {errors} exceptions, {changed} answers changed by trailing prose")
+
+    answer = json.dumps({"answer": [{"id": i, "content": f"value {i}"} for i in range(50)]})
+    print(f"{'output size':>12} {'regex':>10} {'scanner':>10}")
+    for size in args.sizes:
+        # Lines of prose that open braces they never close, then an answer cut off
+        # before its first closing brace: the regex retries from every position.
+        prose = ("The field { was left blank.\n" * (size // 28 + 1))[:size]
+        text = prose + answer[:answer.index("}")]
+        timings = []
+        for extract in (_regex_extract_json, lambda t: scanner(t, "answer")):
+            start = time.perf_counter()
+            extract(text)
+            timings.append(time.perf_counter() - start)
+        print(f"{size:>12} {timings[0] * 1000:>7.1f} ms {timings[1] * 1000:>7.1f} ms")
+
+    # Objects nested deeper than json.loads can parse around a trailing answer: every
+    # level fails, and each would be parsed again on its own.
+    depth = 16000
+    text = '{"level": ' * depth + answer + ' oops}' + '}' * (depth - 1)
+    start = time.perf_counter()
+    found = scanner(text, "answer") is not None
+    print(f"nested {depth} deep ({len(text) // 1000} KB): scanner {(time.perf_counter() - start) * 1000:.1f} ms, "
+          f"answer {'found' if found else 'missed'}")
+
+def bench_pack_prompts(args):
+    """Fill-prompt batches for a long web form: the word-count grouping against the
+    token-budget packer, on fields that share memories with their neighbours."""
+    import json
+    import random
+    from AnalyzeFormHandler import SimplifiedWebFormProcessor
+
+    rng = random.Random(0)
+    pool = [{"id": f"fact-{i}", "content": f"The user's {rng.choice(['home', 'work', 'school'])} record number {i} "
+             f"was issued in {1990 + i % 30} by the office at {i * 7} Main Street.",
+             "metadata": f"source_overview: document {i % 13}"} for i in range(args.fields)]
+    fields_with_memories = [
+        {"field": {"id": f"field_{i}", "name": f"applicant_{rng.choice(['address', 'employer', 'school'])}_{i}",
+                   "type": "text", "label": f"Applicant detail {i}"},
+         "memories": [pool[min(args.fields - 1, i + offset)] for offset in range(3)]}
+        for i in range(args.fields)
+    ]
+
+    # The grouping as it was: words of json.dumps(field) plus words of each new memory.
+    start = time.perf_counter()
+    word_batches = [[]]
+    words = 0
+    seen = set()
+    for item in fields_with_memories:
+        item_words = len(json.dumps(item["field"]).split()) + sum(
+            len(m["content"].split()) for m in item["memories"] if m["id"] not in seen)
+        seen.update(m["id"] for m in item["memories"])
+        if words + item_words > 3000 and words:
+            word_batches.append([])
+            words = 0
+            seen.clear()
+        word_batches[-1].append(item)
+        words += item_words
+    word_time = time.perf_counter() - start
+
+    processor = SimplifiedWebFormProcessor(None, None, None)
+    start = time.perf_counter()
+    batches = processor.group_fields_and_memories(fields_with_memories)
+    packed_time = time.perf_counter() - start
+    start = time.perf_counter()
+    processor.group_fields_and_memories(fields_with_memories)
+    cached_time = time.perf_counter() - start
+
+    packer = processor.packer
+    largest = max(
+        sum(packer.count(json.dumps(item["field"], indent=2)) for item in batch)
+        + sum(packer.count(json.dumps({"content": m["content"], "metadata": m["metadata"]}, indent=2))
+              for m in {m["id"]: m for item in batch for m in item["memories"]}.values())
+        for batch in word_batches
+    )
+    print(f"word grouping:  {len(word_batches):>4} batches  {word_time * 1000:7.1f} ms, "
+          f"largest prompt about {largest} tokens")
+    print(f"token packer:   {len(batches):>4} batches  {packed_time * 1000:7.1f} ms "
+          f"({cached_time * 1000:.1f} ms with warm token counts)")
+    print(packer.report())
+
+def bench_fill_batches(args):
+    """Form fill latency with batches filled one after another and concurrently,
+    against the local chat-completions stand-in; checks that the merged answers
+    come out the same whatever the concurrency."""
+    import contextlib
+    import io
+    from Filler import BatchFiller
+
+    base_url, server = _local_vision_endpoint(args.latency, args.fail_every)
+    batches = [{"fields": [{"id": f"field_{b}_{f}"} for f in range(args.fields_per_batch)]}
+               for b in range(args.batches)]
+
+    def local_fill(batch, timeout):
+        request = urllib.request.Request(f"{base_url}/chat/completions", data=b"{}",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        return [{"id": field["id"], "answer": field["id"].upper()} for field in batch["fields"]]
+
+    try:
+        print(f"{args.batches} batches, {args.latency:.2f}s per call"
+              + (f", every {args.fail_every}th call fails" if args.fail_every else ""))
+        print(f"{'concurrency':>12} {'total':>9}  report")
+        merged = None
+        for concurrency in args.concurrency:
+            filler = BatchFiller(concurrency=concurrency, timeout=args.latency * 5 + 1, backoff=0.1)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                filled = [field for result in filler.fill_all(local_fill, batches) for field in result or []]
+            elapsed = time.perf_counter() - start
+            assert merged is None or filled == merged, "merged answers depend on the concurrency"
+            merged = filled
+            print(f"{concurrency:>12} {elapsed:>7.2f} s  {filler.report()}")
+    finally:
+        server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="FormFiller benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("merge-replay", help="LLM merge calls saved by the distance fast path")
+    p.add_argument("facts", help="text file with one fact per line, document overview last")
+    p.add_argument("--rounds", type=int, default=2, help="ingest the file this many times")
+    p.set_defaults(func=bench_merge_replay)
+
+    p = subparsers.add_parser("search-results", help="per-query overhead of result formatting")
+    p.add_argument("--n-results", type=int, default=3)
+    p.add_argument("--repeat", type=int, default=2000)
+    p.set_defaults(func=bench_search_results)
+
+    p = subparsers.add_parser("startup", help="import time and time to first request")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--port", type=int, default=8899)
+    p.set_defaults(func=bench_startup)
+
+    p = subparsers.add_parser("vector-store", help="Chroma vs NumPy backend latency and memory")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    p.add_argument("--dim", type=int, default=1536, help="embedding width (text-embedding-3-small: 1536)")
+    p.add_argument("--queries", type=int, default=60)
+    p.set_defaults(func=bench_vector_store)
+
+    p = subparsers.add_parser("vector-store-run")
+    p.add_argument("--backend", choices=["chroma", "numpy"], required=True)
+    p.add_argument("--size", type=int, required=True)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--queries", type=int, default=60)
+    p.set_defaults(func=bench_vector_store_run)
+
+    p = subparsers.add_parser("snapshot-load", help="snapshot import vs per-fact ingestion throughput")
+    p.add_argument("--facts", type=int, default=2000)
+    p.add_argument("--backend", choices=["chroma", "numpy"], default="chroma")
+    p.add_argument("--embed-latency", type=float, default=0.0, help="simulated seconds per embedding call")
+    p.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per merge decision")
+    p.set_defaults(func=bench_snapshot_load)
+
+    p = subparsers.add_parser("pdf-pages", help="eager vs streaming PDF rasterization")
+    p.add_argument("--pdf", help="PDF to rasterize (default: a generated text-heavy PDF)")
+    p.add_argument("--pages", type=int, default=30, help="page count of the generated PDF")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--dpi", type=int, default=200)
+    p.add_argument("--batch-size", type=int, default=3)
+    p.set_defaults(func=bench_pdf_pages)
+
+    p = subparsers.add_parser("pdf-pages-run")
+    p.add_argument("pdf")
+    p.add_argument("--mode", choices=["eager", "streaming"], required=True)
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--dpi", type=int, default=200)
+    p.add_argument("--batch-size", type=int, default=3)
+    p.set_defaults(func=bench_pdf_pages_run)
+
+    p = subparsers.add_parser("vision-batches", help="serial vs concurrent vision calls on a local endpoint")
+    p.add_argument("--pages", type=int, default=30)
+    p.add_argument("--latency", type=float, default=1.0, help="simulated seconds per vision call")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--fail-every", type=int, default=0, help="make every Nth call fail with a 500")
+    p.set_defaults(func=bench_vision_batches)
+
+    p = subparsers.add_parser("page-images", help="bytes per page and encode time of each image profile")
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_page_images)
+
+    p = subparsers.add_parser("split-content", help="line vs streaming token-budget content splitter")
+    p.add_argument("--lines", type=int, default=100000)
+    p.add_argument("--page-lines", type=int, default=50)
+    p.add_argument("--max-tokens", type=int, default=3000)
+    p.set_defaults(func=bench_split_content)
+
+    p = subparsers.add_parser("extract-json", help="JSON extraction accuracy, fuzzing and speed")
+    p.add_argument("--fuzz", type=int, default=20000)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    p.set_defaults(func=bench_extract_json)
+
+    p = subparsers.add_parser("pack-prompts", help="word grouping vs token-budget packing of fill prompts")
+    p.add_argument("--fields", type=int, default=500)
+    p.set_defaults(func=bench_pack_prompts)
+
+    p = subparsers.add_parser("fill-batches", help="serial vs concurrent form filling on a local endpoint")
+    p.add_argument("--batches", type=int, default=12)
+    p.add_argument("--fields-per-batch", type=int, default=10)
+    p.add_argument("--latency", type=float, default=1.0, help="simulated seconds per fill call")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--fail-every", type=int, default=0, help="make every Nth call fail with a 500")
+    p.set_defaults(func=bench_fill_batches)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
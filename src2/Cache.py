@@ -0,0 +1,209 @@
+import os
+import time
+import sqlite3
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from array import array
+
+class DiskLRUCache:
+    """Key/blob store in a SQLite file, evicting least recently used entries once the
+    stored values exceed max_bytes. Safe to share between threads."""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit.
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in items.items()]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total - freed <= self.max_bytes:
+                break
+            doomed.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+class CachedEmbeddingFunction:
+    """Wraps a Chroma embedding function with a persistent cache keyed by a hash of
+    (model, text). Vectors are stored as raw float32, so only texts never seen
+    before are sent to the wrapped function, in a single call per batch.
+
+    Chroma only checks the __call__(self, input) signature, so this does not
+    subclass its EmbeddingFunction and importing it does not load chromadb."""
+
+    def __init__(self, embedding_function, model_name, cache_path, max_bytes=256 * 1024 * 1024):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.cache = DiskLRUCache(cache_path, max_bytes)
+        self.embedding_calls = 0
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def __call__(self, input):
+        keys = [self._key(text) for text in input]
+        cached = self.cache.get_many(keys)
+        vectors = {key: array('f', value).tolist() for key, value in cached.items()}
+
+        missing = {key: text for key, text in zip(keys, input) if key not in vectors}
+        if missing:
+            computed = self.embedding_function(list(missing.values()))
+            self.embedding_calls += 1
+            fresh = {}
+            for key, embedding in zip(missing, computed):
+                vectors[key] = [float(x) for x in embedding]
+                fresh[key] = array('f', vectors[key]).tobytes()
+            self.cache.set_many(fresh)
+
+        return [vectors[key] for key in keys]
+
+    def stats(self):
+        return dict(self.cache.stats(), embedding_calls=self.embedding_calls)
+
+class VersionMarker:
+    """Token in a small file next to a collection, replaced on every write, so every
+    process sharing the collection can tell when any of them changed it. Reading
+    it is one small file read, cheap enough to do on each lookup."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return ""
+
+    def bump(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        token = uuid.uuid4().hex
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(token)
+        os.replace(temp_path, self.path)
+        return token
+
+class QueryResultCache:
+    """In-process LRU of query results. Each entry is tagged with the collection
+    version it was computed against and is ignored once the version moves on or
+    the entry is older than ttl seconds."""
+
+    def __init__(self, max_entries=1024, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, created, value = entry
+                if entry_version == version and (self.ttl is None or time.monotonic() - created < self.ttl):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,59 @@
+import time
+import threading
+from Util import Utils
+
+class BatchFiller:
+    """Runs a fill function over prompt batches on a bounded thread pool.
+
+    fill(batch, timeout=...) is one model call; timeout is handed to it so the
+    request itself gives up on a stalled batch. A call that raises is retried with
+    exponential backoff, and a batch that still fails yields None rather than
+    sinking the whole form. Fill functions must not retry on their own (OpenAI
+    clients do by default), so a batch takes at most retries + 1 timeouts plus
+    the backoff. Batches answer disjoint fields, so callers merge the
+    results in batch order and get the same form whichever call finished first."""
+
+    def __init__(self, concurrency=4, timeout=120, retries=2, backoff=1.0):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.last_stats = None
+
+    def iter_fill(self, fill, batches):
+        """Yields (batch index, result) as each batch finishes."""
+        batches = list(batches)
+        stats = {"batches": len(batches), "retried": 0, "failed": 0}
+        lock = threading.Lock()
+        started = time.monotonic()
+
+        def retried(index, error):
+            print(f"Batch {index + 1} failed ({error}), retrying")
+            with lock:
+                stats["retried"] += 1
+
+        def failed(index, error):
+            print(f"Batch {index + 1} failed ({error}), leaving its fields empty.")
+            with lock:
+                stats["failed"] += 1
+            return None
+
+        yield from Utils.bounded_map(lambda batch: fill(batch, timeout=self.timeout), batches,
+                                     max(1, min(self.concurrency, len(batches))),
+                                     retries=self.retries, backoff=self.backoff, on_retry=retried, on_failure=failed)
+
+        stats["workers"] = max(1, min(self.concurrency, len(batches)))
+        stats["seconds"] = time.monotonic() - started
+        self.last_stats = stats
+
+    def fill_all(self, fill, batches):
+        """Results of every batch, in batch order."""
+        results = dict(self.iter_fill(fill, batches))
+        return [results[index] for index in range(len(results))]
+
+    def report(self):
+        stats = self.last_stats
+        if not stats or not stats["batches"]:
+            return "Nothing to fill."
+        return (f"Filled {stats['batches']} batches in {stats['seconds']:.1f}s on {stats['workers']} workers "
+                f"({stats['retried']} retries, {stats['failed']} failed)")
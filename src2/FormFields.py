@@ -0,0 +1,152 @@
+import re
+
+# AcroForm field flags (PDF 1.7, section 12.7.3).
+READ_ONLY = 1
+PUSHBUTTON = 1 << 16
+RADIO = 1 << 15
+
+def _label_from_name(name):
+    """'applicant.firstName[0]' -> 'applicant first name'"""
+    name = re.sub(r'\[\d+\]', '', name)
+    name = re.sub(r'(?<=[a-z])(?=[A-Z])', ' ', name)
+    return re.sub(r'[._\-\s]+', ' ', name).strip().lower()
+
+def _text_fragments(page):
+    """(x, y, text) of every text run on the page, in user space."""
+    fragments = []
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        text = text.strip()
+        if text:
+            x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+            y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+            fragments.append((x, y, text))
+
+    try:
+        page.extract_text(visitor_text=visitor)
+    except Exception:
+        return []
+    return fragments
+
+def _nearby_label(rect, fragments, max_length=120):
+    """The text run that most likely labels a widget: on the same line to its left,
+    or just above it."""
+    x0, y0, x1, y1 = rect
+    middle = (y0 + y1) / 2
+    tolerance = max(y1 - y0, 12)
+    best = None
+    for x, y, text in fragments:
+        if x < x0 and abs(y - middle) <= tolerance:
+            distance = x0 - x
+        elif y1 <= y <= y1 + 2 * tolerance and x0 - 20 <= x <= x1:
+            distance = (y - y1) * 2
+        else:
+            continue
+        if best is None or distance < best[0]:
+            best = (distance, text)
+    return best[1][:max_length].rstrip(' :') if best else None
+
+def _resolve(value):
+    return value.get_object() if hasattr(value, 'get_object') else value
+
+def _inherited(field, key):
+    """A field attribute, looked up through the /Parent chain as the spec allows."""
+    node = field
+    while node is not None:
+        if key in node:
+            return _resolve(node[key])
+        node = _resolve(node['/Parent']) if '/Parent' in node else None
+    return None
+
+def _options(field, widgets):
+    options = []
+    for option in _resolve(field.get('/Opt')) or []:
+        option = _resolve(option)
+        # Choice options are either strings or [export value, display text] pairs.
+        options.append(str(option[-1] if isinstance(option, list) else option))
+    if not options:
+        for widget in widgets:
+            appearances = _resolve(_resolve(widget.get('/AP', {})).get('/N', {}))
+            options.extend(str(state).lstrip('/') for state in appearances if state != '/Off')
+    return list(dict.fromkeys(options))
+
+def _is_filled(value):
+    """Whether a field value (/V) holds an answer; an unchecked box is /Off."""
+    value = _resolve(value)
+    if isinstance(value, list):
+        return any(_is_filled(item) for item in value)
+    return value is not None and str(value).strip() not in ('', '/Off')
+
+def _question(label, field_type, flags, options):
+    if field_type == '/Btn' and not flags & RADIO:
+        return f'Should "{label}" be checked? (yes/no)'
+    question = f'What should be entered for "{label}"?'
+    if options:
+        question += f" Options: {', '.join(options)}."
+    return question
+
+def extract_form_questions(file_path):
+    """Question list in the process_pdf_form format, built from the PDF's own
+    AcroForm fields: exact field names, tooltips (/TU), and the text next to each
+    widget. Fields that already hold a value are skipped, so a form filled in
+    completely yields no questions. Returns None when the PDF has no fillable
+    fields, or when pypdf is not
+    installed, so the caller falls back to vision."""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+
+    try:
+        reader = PdfReader(file_path)
+        if not reader.get_fields():
+            return None
+    except Exception:
+        return None
+
+    # Fields in page order, with their widgets and the label found next to the first one.
+    fields = {}
+    for page in reader.pages:
+        fragments = None
+        for annotation in _resolve(page.get('/Annots')) or []:
+            widget = _resolve(annotation)
+            if widget.get('/Subtype') != '/Widget':
+                continue
+            # A widget is either the field itself or a kid of it (radio groups,
+            # fields shown on several pages).
+            field = widget if '/T' in widget else _resolve(widget.get('/Parent', widget))
+            parts = []
+            node = field
+            while node is not None:
+                if '/T' in node:
+                    parts.append(str(node['/T']))
+                node = _resolve(node['/Parent']) if '/Parent' in node else None
+            name = '.'.join(reversed(parts))
+            if not name:
+                continue
+            if name not in fields:
+                if fragments is None:
+                    fragments = _text_fragments(page)
+                rect = [float(v) for v in widget.get('/Rect', [0, 0, 0, 0])]
+                fields[name] = {'field': field, 'widgets': [], 'label': _nearby_label(rect, fragments)}
+            fields[name]['widgets'].append(widget)
+
+    questions = []
+    fillable = 0
+    for name, entry in fields.items():
+        field = entry['field']
+        field_type = _inherited(field, '/FT')
+        flags = int(_inherited(field, '/Ff') or 0)
+        if field_type == '/Sig' or flags & READ_ONLY or (field_type == '/Btn' and flags & PUSHBUTTON):
+            continue
+        fillable += 1
+        # Already-filled fields are left alone, as the vision prompt asks.
+        if _is_filled(_inherited(field, '/V')):
+            continue
+        label = str(field['/TU']) if '/TU' in field else entry['label'] or _label_from_name(name)
+        questions.append({
+            "field_name": name,
+            "question": _question(label, field_type, flags, _options(field, entry['widgets']))
+        })
+
+    return {"questions": questions} if fillable else None
@@ -1,4 +1,5 @@
 import os
+import argparse
 from dotenv import load_dotenv
 from rich.console import Console
 from rich.panel import Panel
@@ -7,21 +8,28 @@ from rich.table import Table
 from rich import print_json
 from Memory import MemoryManager
 from Preprocess import Preprocessor
+from Registry import IngestRegistry
 from openai import OpenAI
 from Util import Utils
+from Packer import BatchPacker
+from Filler import BatchFiller
 import json
 
 load_dotenv()
 
 class FormFillerInterface:
-    def __init__(self, openAI_client, memory_manager, preprocessor, debug=False):
+    def __init__(self, openAI_client, memory_manager, preprocessor, debug=False, interactive=True, fill_concurrency=4):
         self.console = Console()
         self.memory_manager = memory_manager
         self.preprocessor = preprocessor
         self.client = openAI_client
-        self.pdf_cache = {}
+        # Questions and memories for fill_form are packed into gpt-4o sized prompts.
+        self.packer = BatchPacker("gpt-4o")
+        self.filler = BatchFiller(concurrency=fill_concurrency)
         self.question_with_answers = []
         self.debug = debug
+        # Without interaction nothing is confirmed: every batch is filled at once.
+        self.interactive = interactive
 
     def run(self):
         self.console.print(Panel.fit(
@@ -42,6 +50,8 @@ class FormFillerInterface:
                 self.console.print("[red]Invalid command. Type 'help' for a list of commands.[/red]")
 
     def user_continue(self):
+        if not self.interactive:
+            return True
         response = self.console.input("Continue? (y/n): ").lower()
         return response == 'y'
 
@@ -66,14 +76,12 @@ class FormFillerInterface:
             self.console.print(f"[yellow]Warning: File '{file_path}' does not exist.[/yellow]")
             return
 
-        if file_path in self.pdf_cache:
-            questions = self.pdf_cache[file_path]
-        elif file_path.endswith(".json"):
+        if file_path.endswith(".json"):
             with open(file_path, "r") as f:
                 questions = json.load(f)
         elif file_path.endswith(".pdf"):
+            # The preprocessor's registry returns stored questions for a PDF it has seen.
             questions = self.preprocessor.process_pdf_form(file_path, comment)
-            self.pdf_cache[file_path] = questions
             with open(tmp_file_path, "w") as f:
                 json.dump(questions, f)
         else:
@@ -93,27 +101,27 @@ class FormFillerInterface:
                 return
         
         grouped_batches = self.group_questions_and_memories(q_w_m)
+        self.console.print(f"[cyan]{self.packer.report()}[/cyan]")
         if self.debug:
             self.console.print("\n[cyan]Grouped batches:[/cyan]")
             print_json(data=grouped_batches)
             if not self.user_continue():
                 return
 
+        self.console.print(f"\n[cyan]Filling {len(grouped_batches)} batches...[/cyan]")
+        results = {}
+        for index, batch_filled_form in self.filler.iter_fill(lambda batch, timeout: self.fill_form(batch, comment, timeout), grouped_batches):
+            results[index] = batch_filled_form or {}
+            self.console.print(f"[cyan]Batch {index + 1} of {len(grouped_batches)} filled[/cyan]")
+        self.console.print(f"[cyan]{self.filler.report()}[/cyan]")
+
+        # Merged in batch order, so the result does not depend on which call finished first.
         filled_form = {}
-        for i, batch in enumerate(grouped_batches, 1):
-            self.console.print(f"\n[cyan]Processing batch {i} of {len(grouped_batches)}[/cyan]")
-            batch_filled_form = self.fill_form(batch, comment)
-            filled_form.update(batch_filled_form)
-            
-            # Update q_w_m with the answers
-            for question in q_w_m:
-                if question['id'] in batch_filled_form:
-                    question['answer'] = batch_filled_form[question['id']]
-            
-            if i < len(grouped_batches):
-                continue_processing = self.console.input("Continue to next batch? (y/n): ").lower()
-                if continue_processing != 'y':
-                    break
+        for index in range(len(grouped_batches)):
+            filled_form.update(results[index])
+        for question in q_w_m:
+            if question['id'] in filled_form:
+                question['answer'] = filled_form[question['id']]
         
         self.console.print("\n[green]Form filling complete. Final result:[/green]")
         self.question_with_answers = q_w_m
@@ -121,77 +129,55 @@ class FormFillerInterface:
 
     def retrieve_memories_for_questions(self, questions):
         question_with_memories = []
-        for i, item in enumerate(questions):
-            memories = self.memory_manager.search_memories(item['question'], n_results=3)
-            if not memories.empty:
+        all_memories = self.memory_manager.search_records_batch([item['question'] for item in questions], n_results=3)
+        for i, (item, memories) in enumerate(zip(questions, all_memories)):
+            if memories:
                 question_with_memories.append({
                     "question": item['question'],
                     "field_name": item['field_name'],
                     "id": i, # Use the index as an ID
                     "memories": [
                         {
-                            "id": row['id'],
-                            "content": row['document'],
-                            "metadata": row['metadata'][row['metadata'].find("source_overview"):]
+                            "id": record.id,
+                            "content": record.document,
+                            "metadata": f"source_overview: {record.metadata['source_overview']}"
                         }
-                        for _, row in memories.iterrows()
+                        for record in memories
                     ]
                 })
         return question_with_memories
     
-    def group_questions_and_memories(self, questions_with_memories, max_words = 3000):
-        def word_count(text: str) -> int:
-            return len(text.split())
-            
-        grouped_batches = []
-        current_batch = {"questions": [], "memories": []}
-        current_word_count = 0
-        current_memory_ids = set()
+    def group_questions_and_memories(self, questions_with_memories):
+        packer = self.packer
+        items = [
+            (
+                packer.count(item['question']) + packer.count(str(item['field_name'])) + 12,
+                [(memory['id'], packer.count(memory['content']) + packer.count(memory['metadata']) + 10)
+                 for memory in item['memories']]
+            )
+            for item in questions_with_memories
+        ]
 
-        for i, item in enumerate(questions_with_memories):
-            question_words = word_count(item['question'])
-            
-            # Filter out duplicate memories
-            unique_memories = []
-            memory_words = 0
-            for memory in item['memories']:
-                if memory['id'] not in current_memory_ids:
-                    unique_memory = {
-                        "content": memory['content'],
-                        "metadata": memory['metadata']
+        grouped_batches = []
+        for indices, memory_ids in packer.pack(items):
+            memories = {memory['id']: memory for i in indices for memory in questions_with_memories[i]['memories']}
+            grouped_batches.append({
+                "questions": [
+                    {
+                        "question": questions_with_memories[i]['question'],
+                        "field_name": questions_with_memories[i]['field_name'],
+                        "id": questions_with_memories[i]['id']
                     }
-                    unique_memories.append(unique_memory)
-                    memory_words += word_count(memory['content'])
-                    current_memory_ids.add(memory['id'])
-
-            item_words = question_words + memory_words
-
-            if current_word_count + item_words > max_words and (
-                current_batch["questions"] or current_batch["memories"]):
-                
-                grouped_batches.append(current_batch)
-                current_batch = {"questions": [], "memories": []}
-                current_word_count = 0
-                current_memory_ids.clear()
-
-            # Add the question
-            current_batch["questions"].append({
-                "question": item['question'],
-                "field_name": item['field_name'],
-                "id": item['id']
+                    for i in indices
+                ],
+                "memories": [
+                    {"content": memories[memory_id]['content'], "metadata": memories[memory_id]['metadata']}
+                    for memory_id in memory_ids
+                ]
             })
-            
-            # Add unique memories
-            current_batch["memories"].extend(unique_memories)
-            
-            current_word_count += item_words
-
-        if current_batch["questions"] or current_batch["memories"]:
-            grouped_batches.append(current_batch)
-
         return grouped_batches
     
-    def fill_form(self, batch, user_comment):
+    def fill_form(self, batch, user_comment, timeout=None):
         questions = batch["questions"]
         memories = batch["memories"]
         
@@ -211,16 +197,17 @@ class FormFillerInterface:
         Ensure that your response is a valid JSON object. Here's the user's comment about the form: {user_comment}
         """
         
-        response = self.client.chat.completions.create(
+        response = self.client.with_options(max_retries=0).chat.completions.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are an AI assistant that fills out forms based on provided memories. Each field is reworded into a question, and your answer to the question will be field value. You will answer those question in order, based on the provided memories. For non-factual or creativity related questions (for example, explain a matter, write a report), use the memory to generate a reasonable response in a proper length."},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            timeout=timeout
         )
         
         try:
-            filled_form = Utils.extractValidJson(response.choices[0].message.content)
+            filled_form = Utils.extractValidJson(response.choices[0].message.content, key="answer")
             return {item['id']: item['content'] for item in filled_form['answer']}
         except Exception as e:
             self.console.print(f'[red]Error: {e}. Using an empty dictionary instead.[/red]')
@@ -248,6 +235,12 @@ class FormFillerInterface:
         self.console.print(table)
 
 def main():
+    parser = argparse.ArgumentParser(description="Fill PDF or JSON forms from the knowledge base.")
+    parser.add_argument("files", nargs="*", help="forms to fill without prompting, then exit")
+    parser.add_argument("--yes", action="store_true", help="never ask for confirmation")
+    parser.add_argument("--concurrency", type=int, default=4, help="batches filled at once")
+    args = parser.parse_args()
+
     # Get the API key from the environment
     api_key = os.getenv('OPENAI_API_KEY')
     
@@ -255,9 +248,14 @@ def main():
         Console().print("[red]Error: OPENAI_API_KEY not found in .env file[/red]")
         return
     memory_manager = MemoryManager(api_key)
-    preprocessor = Preprocessor(api_key)
+    preprocessor = Preprocessor(api_key, IngestRegistry())
     openAI_client = OpenAI(api_key=api_key)
-    form_filler = FormFillerInterface(openAI_client, memory_manager, preprocessor)
+    form_filler = FormFillerInterface(openAI_client, memory_manager, preprocessor,
+                                      interactive=not (args.yes or args.files), fill_concurrency=args.concurrency)
+    if args.files:
+        for file_path in args.files:
+            form_filler.process_file(file_path)
+        return
     form_filler.run()
 
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 import os
+import hashlib
 from dotenv import load_dotenv
 from rich.console import Console
 from rich.panel import Panel
@@ -6,15 +7,18 @@ from rich.text import Text
 from rich.table import Table
 from Memory import MemoryManager
 from Preprocess import Preprocessor
+from Registry import IngestRegistry
+from Util import Utils
 
 # Load the .env file
 load_dotenv()
 
 class ConsoleInterface:
-    def __init__(self, memory_manager, preprocessor):
+    def __init__(self, memory_manager, preprocessor, registry=None):
         self.console = Console()
         self.memory_manager = memory_manager
         self.preprocessor = preprocessor
+        self.registry = registry
 
     def display_help(self):
         table = Table(title="Knowledge Base Updater Commands")
@@ -23,8 +27,10 @@ class ConsoleInterface:
         table.add_row("file <path> <comment>", "Upload and process a file")
         table.add_row("update <info>", "Directly update knowledge base")
         table.add_row("search <query>", "Search the knowledge base")
-        table.add_row("all", "Display all memories")
+        table.add_row("all", "Display all memories, a page at a time")
         table.add_row("del <query>", "Delete a memory")
+        table.add_row("export <dir>", "Save the knowledge base to a snapshot")
+        table.add_row("import <dir>", "Load a snapshot without re-embedding")
         table.add_row("help", "Display this help message")
         table.add_row("exit", "Exit the program")
         self.console.print(table)
@@ -36,19 +42,36 @@ class ConsoleInterface:
             comment = os.path.basename(file_path)
         else:
             file_path, comment = split_res
+
+        fingerprint = None
+        if self.registry is not None and os.path.isfile(file_path):
+            fingerprint = Utils.file_fingerprint(file_path)
+            known_ids = self.registry.get_document(self.memory_manager.store_key, fingerprint)
+            # The facts may have been deleted since; then the file is ingested again.
+            if known_ids is not None and self.memory_manager.has_entries(known_ids):
+                self.console.print(f"[green]{file_path} is unchanged since it was ingested ({len(known_ids)} facts), skipping.[/green]")
+                return
         
         self.console.print(f"Processing file: {file_path} with comment: {comment}")
         content = self.preprocessor.extract_knowledge(file_path, comment)
         
-        # Split content into batches
+        # Batches are produced as they are consumed; the splitter never holds them all.
         batches = self.preprocessor.split_content(content)
+        fact_ids = []
+        complete = True
         
         for i, batch in enumerate(batches):
-            self.console.print(f"[cyan]Processing batch {i+1} of {len(batches)}[/cyan]")
+            known_ids = self.known_batch(batch)
+            if known_ids is not None:
+                self.console.print(f"[cyan]Batch {i+1} is unchanged, skipping.[/cyan]")
+                fact_ids.extend(known_ids)
+                continue
+
+            self.console.print(f"[cyan]Processing batch {i+1}[/cyan]")
             knowledges = self.memory_manager.generate_knowledges(batch, f"name: {comment} - Part {i+1}")
             
             if not interactive:
-                self.memory_manager.add_new_facts(knowledges)
+                fact_ids.extend(self.store_batch(batch, knowledges))
                 self.console.print("[green]Updated knowledge base with all batches.[/green]")
                 continue
 
@@ -58,25 +81,52 @@ class ConsoleInterface:
                         
             answer = self.console.input("Do you want to update with this batch? (y/n/all/stop): ")
             if answer.lower() == 'y':
-                self.memory_manager.add_new_facts(knowledges)
+                fact_ids.extend(self.store_batch(batch, knowledges))
                 self.console.print("[green]Updated knowledge base with this batch.[/green]")
             elif answer.lower() == 'all':
-                self.memory_manager.add_new_facts(knowledges)
-                for remaining_batch in batches[i+1:]:
-                    remaining_knowledges = self.memory_manager.generate_knowledges(remaining_batch, f"name: {comment} - Continuation")
-                    self.memory_manager.add_new_facts(remaining_knowledges)
+                fact_ids.extend(self.store_batch(batch, knowledges))
+                for remaining_batch in batches:
+                    known_ids = self.known_batch(remaining_batch)
+                    if known_ids is None:
+                        remaining_knowledges = self.memory_manager.generate_knowledges(remaining_batch, f"name: {comment} - Continuation")
+                        known_ids = self.store_batch(remaining_batch, remaining_knowledges)
+                    fact_ids.extend(known_ids)
                 self.console.print("[green]Updated knowledge base with all remaining batches.[/green]")
                 break
             elif answer.lower() == 'stop':
+                complete = False
                 self.console.print("[yellow]File processing stopped.[/yellow]")
                 break
             elif answer.lower() == 'n':
+                complete = False
                 self.console.print("[yellow]Skipped this batch.[/yellow]")
             else:
+                complete = False
                 self.console.print("[red]Invalid input. Skipping this batch.[/red]")
 
+        # Only a fully ingested file is remembered; a partial run is resumed batch by batch.
+        if complete and fingerprint is not None:
+            self.registry.record_document(self.memory_manager.store_key, fingerprint, file_path, comment, fact_ids)
         self.console.print("[green]File processing complete.[/green]")
 
+    @staticmethod
+    def batch_hash(batch):
+        return hashlib.sha256(batch.encode('utf-8')).hexdigest()
+
+    def known_batch(self, batch):
+        if self.registry is None:
+            return None
+        known_ids = self.registry.get_batch(self.memory_manager.store_key, self.batch_hash(batch))
+        if known_ids is None or not self.memory_manager.has_entries(known_ids):
+            return None
+        return known_ids
+
+    def store_batch(self, batch, knowledges):
+        fact_ids = self.memory_manager.add_new_facts(knowledges)
+        if self.registry is not None:
+            self.registry.record_batch(self.memory_manager.store_key, self.batch_hash(batch), fact_ids)
+        return fact_ids
+
     def process_update_command(self, info):
         self.memory_manager.add_new_fact(info)
         self.console.print("[green]Updated knowledge base.[/green]")
@@ -96,21 +146,40 @@ class ConsoleInterface:
         else:
             self.console.print("[yellow]No results found.[/yellow]")
 
-    def process_all_command(self):
-        with self.console.status("[cyan]Fetching all memories...[/cyan]"):
-            memories = self.memory_manager.get_all_memories()
-        if not memories.empty:
-            for _, row in memories.iterrows():
-                table = Table(title=f"Memory ID: {row['ID']}", show_header=False, show_lines=True)
+    def process_all_command(self, page_size=20):
+        offset = 0
+        shown = 0
+        while offset is not None:
+            with self.console.status("[cyan]Fetching memories...[/cyan]"):
+                records, offset = self.memory_manager.get_memories_page(page_size, offset)
+            for record in records:
+                table = Table(title=f"Memory ID: {record.id}", show_header=False, show_lines=True)
                 table.add_column(style="cyan")
                 table.add_column(style="green")
-                table.add_row("Content", Text(row['Document'], overflow="fold"))
-                table.add_row("Metadata", Text(row['Metadata'], overflow="fold"))
+                table.add_row("Content", Text(record.document, overflow="fold"))
+                table.add_row("Metadata", Text(self.memory_manager.format_metadata(record.metadata), overflow="fold"))
                 self.console.print(table)
                 self.console.print("---" * 30)  # Add a dashed line between memories
-        else:
+            shown += len(records)
+            if offset is not None and self.console.input(f"Shown {shown} memories. Show more? (y/n): ").lower() != 'y':
+                break
+        if shown == 0:
             self.console.print("[yellow]No memories found.[/yellow]")
 
+    def process_export_command(self, path):
+        with self.console.status("[cyan]Exporting knowledge base...[/cyan]"):
+            count = self.memory_manager.export_snapshot(path)
+        self.console.print(f"[green]Exported {count} memories to {path}[/green]")
+
+    def process_import_command(self, path):
+        try:
+            with self.console.status("[cyan]Importing snapshot...[/cyan]"):
+                count = self.memory_manager.import_snapshot(path)
+        except (OSError, ValueError) as e:
+            self.console.print(f"[red]Failed to import snapshot: {e}[/red]")
+            return
+        self.console.print(f"[green]Imported {count} memories from {path}[/green]")
+
     def process_del_id_command(self, id):
         if self.memory_manager.delete_entry(id):
             self.console.print(f"[green]Successfully deleted memory with ID: {id}[/green]")
@@ -185,6 +254,10 @@ class ConsoleInterface:
                 self.process_all_command()
             elif command[0] == "del" and len(command) == 2:
                 self.process_delete_command(command[1])
+            elif command[0] == "export" and len(command) == 2:
+                self.process_export_command(command[1])
+            elif command[0] == "import" and len(command) == 2:
+                self.process_import_command(command[1])
             else:
                 self.console.print("[red]Invalid command. Type 'help' for a list of commands.[/red]")
 
@@ -195,9 +268,10 @@ def main():
     if not api_key:
         Console().print("[red]Error: OPENAI_API_KEY not found in .env file[/red]")
         return
-    memory_manager = MemoryManager(api_key)
-    preprocessor = Preprocessor(api_key)
-    console_interface = ConsoleInterface(memory_manager, preprocessor)
+    registry = IngestRegistry()
+    memory_manager = MemoryManager(api_key, registry=registry)
+    preprocessor = Preprocessor(api_key, registry)
+    console_interface = ConsoleInterface(memory_manager, preprocessor, registry)
     console_interface.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+
+# Short HTML field names and abbreviations mapped to the words a stored fact would use.
+FIELD_ALIASES = {
+    "fname": "first name",
+    "firstname": "first name",
+    "givenname": "first name given name",
+    "lname": "last name",
+    "lastname": "last name",
+    "surname": "last name surname family name",
+    "familyname": "last name family name",
+    "mname": "middle name",
+    "fullname": "full name",
+    "dob": "date of birth",
+    "bday": "birthday date of birth",
+    "birthdate": "date of birth",
+    "zip": "zip postal code",
+    "zipcode": "zip postal code",
+    "postcode": "postal code zip",
+    "postal": "postal code zip",
+    "tel": "phone number telephone",
+    "phone": "phone number telephone",
+    "mobile": "mobile phone number",
+    "cell": "cell phone number",
+    "email": "email address",
+    "mail": "email address",
+    "addr": "address",
+    "addr1": "street address",
+    "addr2": "address line 2 apartment",
+    "street": "street address",
+    "apt": "apartment unit",
+    "city": "city town",
+    "state": "state province",
+    "org": "organization company employer",
+    "company": "company employer organization",
+    "employer": "employer company",
+    "ssn": "social security number",
+    "dl": "driver license number",
+    "gpa": "gpa grade point average",
+    "linkedin": "linkedin profile url",
+    "url": "website url",
+    "gender": "gender sex",
+    "sex": "sex gender",
+}
+
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "to", "in", "on", "and", "or", "is", "are", "was",
+    "your", "you", "my", "what", "which", "please", "enter", "provide", "field"
+}
+
+_CAMEL = re.compile(r'(?<=[a-z])(?=[A-Z])|(?<=[A-Za-z])(?=[0-9])|(?<=[0-9])(?=[A-Za-z])')
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    return _TOKEN.findall(_CAMEL.sub(' ', text).lower())
+
+def expand_query(text):
+    """Query term variants: the query's own terms, plus one variant per alias that
+    matches the whole query or one of its terms."""
+    terms = [t for t in tokenize(text) if t not in STOPWORDS]
+    variants = [terms] if terms else []
+    compact = re.sub(r'[^a-z0-9]', '', text.lower())
+    for key in dict.fromkeys([compact] + terms):
+        if key in FIELD_ALIASES:
+            variants.append(tokenize(FIELD_ALIASES[key]))
+    return variants
+
+class BM25Index:
+    """Inverted index with BM25 scoring over memory documents. Kept up to date
+    incrementally by MemoryManager on every write."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.doc_lengths = {}
+        self.records = {}
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, ids, documents, metadatas):
+        with self._lock:
+            for id, document, metadata in zip(ids, documents, metadatas):
+                self._remove(id)
+                terms = Counter(tokenize(document))
+                for term, tf in terms.items():
+                    self.postings[term][id] = tf
+                self.doc_lengths[id] = sum(terms.values())
+                self.total_length += self.doc_lengths[id]
+                self.records[id] = (document, metadata)
+
+    def update(self, ids, documents=None, metadatas=None):
+        for i, id in enumerate(ids):
+            if id not in self.records:
+                continue
+            document, metadata = self.records[id]
+            self.add([id], [documents[i] if documents is not None else document],
+                     [metadatas[i] if metadatas is not None else metadata])
+
+    def delete(self, ids):
+        with self._lock:
+            for id in ids:
+                self._remove(id)
+
+    def _remove(self, id):
+        if id not in self.records:
+            return
+        for term in set(tokenize(self.records[id][0])):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(id)
+        del self.records[id]
+
+    def search(self, variants, n_results=5):
+        """Returns [(id, score, covered)] best first, where covered means the document
+        contains every term of at least one query variant."""
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if n_docs == 0:
+                return []
+            avg_length = self.total_length / n_docs
+            scores = defaultdict(float)
+            for term in dict.fromkeys(t for variant in variants for t in variant):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[id] / avg_length)
+                    scores[id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+            return [
+                (id, score, any(variant and all(id in self.postings.get(t, ()) for t in variant) for variant in variants))
+                for id, score in ranked
+            ]
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse several ranked id lists; ids ranked high in any list come first."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] += 1 / (k + rank + 1)
+    return sorted(scores, key=lambda id: scores[id], reverse=True)
@@ -1,23 +1,147 @@
 import os
 import re
 import json
-import pandas as pd
+import uuid
+import threading
 from Util import Utils
-from openai import OpenAI
-import chromadb
-import chromadb.utils.embedding_functions as embedding_functions
+from Cache import CachedEmbeddingFunction, QueryResultCache, VersionMarker
+from LexicalIndex import BM25Index, expand_query, reciprocal_rank_fusion
+
+class MemoryRecord:
+    """One search hit. Plain attributes instead of a DataFrame row, for code that
+    consumes search results programmatically."""
+    __slots__ = ('id', 'distance', 'document', 'metadata')
+
+    def __init__(self, id, distance, document, metadata):
+        self.id = id
+        self.distance = distance
+        self.document = document
+        self.metadata = metadata
+
+    @classmethod
+    def from_chroma(cls, chroma_results, query_index=0):
+        distances = chroma_results['distances'][query_index] if chroma_results['distances'] else None
+        documents = chroma_results['documents'][query_index] if chroma_results['documents'] else None
+        metadatas = chroma_results['metadatas'][query_index] if chroma_results['metadatas'] else None
+        return tuple(
+            cls(
+                id,
+                distances[i] if distances else None,
+                documents[i] if documents else None,
+                metadatas[i] if metadatas else None
+            )
+            for i, id in enumerate(chroma_results['ids'][query_index])
+        )
+
+    def metadata_text(self):
+        return '\n'.join([f"{k}: {v}" for k, v in (self.metadata or {}).items()])
+
+    def to_dict(self):
+        return {'id': self.id, 'distance': self.distance, 'document': self.document, 'metadata': self.metadata_text()}
 
 class MemoryManager:
-    def __init__(self, api_key, collection_name="test", db_path="chromaDB"):
+    def __init__(self, api_key, collection_name="test", db_path="chromaDB", merge_concurrency=4,
+                 duplicate_distance=0.02, distinct_distance=1.0, cache_dir="cache",
+                 embedding_cache_bytes=256 * 1024 * 1024, query_cache_size=1024, query_cache_ttl=600,
+                 backend="chroma", lexical_margin=1.5, registry=None):
         self.api_key = api_key
-        self.client = OpenAI()
-        
-        self.chroma_client = chromadb.PersistentClient(path=db_path)
-        self.openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=api_key,
-            model_name="text-embedding-3-small"
-        )
-        self.collection = self.chroma_client.get_or_create_collection(collection_name, embedding_function=self.openai_ef)
+        # IngestRegistry to drop ingest records from when the facts they list are deleted.
+        self.registry = registry
+        self.merge_concurrency = merge_concurrency
+        # Squared L2 distance bands on normalized embeddings (2 - 2 * cosine): at or
+        # below duplicate_distance a neighbour is merged locally, at or above
+        # distinct_distance it is never merged, in between the LLM decides.
+        self.duplicate_distance = duplicate_distance
+        self.distinct_distance = distinct_distance
+        self.merge_stats = {"llm_calls": 0, "local_duplicates": 0, "local_distinct": 0,
+                            "speculative_llm_calls": 0, "speculative_unused": 0}
+        self._merge_stats_lock = threading.Lock()
+        # Replaced on every write, by this or any other process using the collection,
+        # so cached search results never outlive the data.
+        self.version_marker = VersionMarker(os.path.join(db_path, f"{collection_name}.version"))
+        self.query_cache = QueryResultCache(query_cache_size, query_cache_ttl)
+
+        # The OpenAI client and the Chroma collection are created on first use, so
+        # constructing a MemoryManager does not import openai or chromadb.
+        self.collection_name = collection_name
+        self.db_path = db_path
+        self.backend = backend
+        self.embedding_model = "text-embedding-3-small"
+        self.cache_dir = cache_dir
+        self.embedding_cache_bytes = embedding_cache_bytes
+        self._client = None
+        self._collection = None
+        self._openai_ef = None
+        self._connect_lock = threading.Lock()
+        self._lexical = None
+        self._lexical_lock = threading.Lock()
+        # Version token the lexical index and the opened store were last in step with.
+        self._synced_version = None
+        # A lexical hit stands alone only if it outscores the runner-up by this factor.
+        self.lexical_margin = lexical_margin
+        self.retrieval_stats = {"queries": 0, "lexical_only": 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._connect_lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI()
+        return self._client
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self._connect()
+        return self._collection
+
+    @property
+    def openai_ef(self):
+        if self._openai_ef is None:
+            self._connect()
+        return self._openai_ef
+
+    def _connect(self):
+        with self._connect_lock:
+            if self._collection is not None:
+                return
+            import chromadb.utils.embedding_functions as embedding_functions
+
+            self._openai_ef = CachedEmbeddingFunction(
+                embedding_functions.OpenAIEmbeddingFunction(
+                    api_key=self.api_key,
+                    model_name=self.embedding_model
+                ),
+                model_name=self.embedding_model,
+                cache_path=os.path.join(self.cache_dir, "embeddings.sqlite3"),
+                max_bytes=self.embedding_cache_bytes
+            )
+            if self.backend == "numpy":
+                from VectorStore import NumpyStore
+                self._collection = NumpyStore(os.path.join(self.db_path, f"{self.collection_name}.numpy"), self._openai_ef)
+            elif self.backend == "chroma":
+                from VectorStore import ChromaStore
+                self._collection = ChromaStore(self.db_path, self.collection_name, self._openai_ef)
+            else:
+                raise ValueError(f"Unknown storage backend: {self.backend}")
+
+    @property
+    def store_key(self):
+        """Identifies the collection, for records kept outside of it."""
+        return f"{self.backend}:{os.path.abspath(self.db_path)}:{self.collection_name}"
+
+    def has_entries(self, ids):
+        """Whether every id in ids is still stored, with one lookup."""
+        ids = set(ids)
+        if not ids:
+            return True
+        return len(set(self.collection.get(ids=list(ids), include=[])['ids'])) == len(ids)
+
+    def warm_up(self):
+        """Create the OpenAI client and open the collection ahead of the first request."""
+        self.client
+        self.collection
 
     def generate_knowledges(self, text, user_metadata='name: Mingrui Zhang'):
         response = self.client.chat.completions.create(
@@ -51,10 +175,183 @@ class MemoryManager:
             "source_overview": overview
         }
 
-    def add_new_facts(self, res):
+    def add_new_facts(self, res, batched=True):
+        """Store generate_knowledges output (facts, then the document overview) and
+        return the ids of the entries each fact was added to or merged into."""
         res = [r for r in res if len(r.strip()) > 0]
-        for r in res[:-1]:
-            self.add_or_update_info(r, res[-1])
+        if not res:
+            return []
+        if batched:
+            return self.add_facts_batch(res[:-1], res[-1]).get("ids", [])
+        return [self.add_or_update_info(r, res[-1]) for r in res[:-1]]
+
+    def add_facts_batch(self, facts, new_metadata=''):
+        """Ingest a list of facts with one embedding request, one multi-query lookup
+        and one write per operation kind, keeping the per-fact merge rules of
+        add_or_update_info (top-2 neighbours, first accepted merge wins)."""
+        if not facts:
+            return {}
+        import numpy as np
+
+        embeddings = [list(e) for e in self.openai_ef(facts)]
+        results = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=2,
+            include=["metadatas", "documents", "distances"]
+        )
+
+        # Squared L2 between every pair of facts, as Chroma's default "l2" space
+        # reports them, computed once for both passes below.
+        matrix = np.asarray(embeddings, dtype=np.float64)
+        norms = np.einsum('ij,ij->i', matrix, matrix)
+        fact_distances = np.maximum(norms[:, None] + norms[None, :] - 2 * matrix @ matrix.T, 0).tolist()
+
+        hits = [Utils.format_chroma_results(results, q) for q in range(len(facts))]
+        decisions, speculated = self._speculate_merges(facts, fact_distances, hits, new_metadata)
+
+        # Rows written earlier in this batch must be visible to later facts, the
+        # same way they would be after a per-fact collection.add/update.
+        pending = {}
+        updated = {}
+        ids = []
+        for q, (new_info, embedding) in enumerate(zip(facts, embeddings)):
+            candidates = self._batch_candidates(hits[q], fact_distances[q], pending, updated)
+
+            for item in candidates:
+                existing_metadata = item['metadata']
+                # A speculative decision is only reused if the candidate still reads the
+                # same; an entry already merged by an earlier fact is judged again.
+                key = (q, item['key'], item['document'], existing_metadata['source_overview'])
+                result = decisions.get(key)
+                speculated.discard(key)
+                if result is None:
+                    result = self.resolve_merge(item['document'], existing_metadata['source_overview'], new_info, new_metadata, item['distance'])
+
+                if result["merge_decision"]:
+                    existing_metadata['source_overview'] = result["merged_metadata"]
+                    existing_metadata['last_updated'] = Utils.get_current_timestamp()
+                    target = pending if item['id'] in pending else updated
+                    row = target.setdefault(item['id'], {'embedding': None})
+                    row.update(document=result["merged_information"], metadata=existing_metadata, stale=True)
+                    print(f"Updated existing entry: {item['id']}")
+                    print(f"Reason for merge: {result['reason']}")
+                    ids.append(item['id'])
+                    break
+            else:
+                new_id = Utils.content_id(new_info)
+                ids.append(new_id)
+                pending[new_id] = {
+                    'document': new_info,
+                    'metadata': self.generate_metadata(new_metadata),
+                    'embedding': embedding,
+                    'fact_index': q,
+                    'stale': False
+                }
+
+        # Speculative calls whose candidate changed or was never reached.
+        self._count_merge("speculative_unused", len(speculated))
+
+        embedding_calls = 1
+        stale = [row for row in list(pending.values()) + list(updated.values()) if row['stale']]
+        if stale:
+            for row, e in zip(stale, self.openai_ef([row['document'] for row in stale])):
+                row['embedding'] = list(e)
+            embedding_calls += 1
+
+        round_trips = 1
+        stored_ids = {}
+        for write, rows in ((self._store_add, pending), (self._store_update, updated)):
+            if rows:
+                stored_ids[write] = write(
+                    ids=list(rows),
+                    documents=[row['document'] for row in rows.values()],
+                    metadatas=[row['metadata'] for row in rows.values()],
+                    embeddings=[row['embedding'] for row in rows.values()]
+                )
+                round_trips += 1
+        if pending:
+            # An added fact may have been stored under another id than the one planned.
+            renamed = dict(zip(pending, stored_ids[self._store_add]))
+            ids = [renamed.get(id, id) for id in ids]
+            for id in renamed.values():
+                print(f"Added new entry: {id}")
+
+        # The per-fact path embeds each fact for its query and again on add/update,
+        # and makes one query plus one write round-trip per fact.
+        stats = {
+            "facts": len(facts),
+            "added": len(pending),
+            "updated": len(updated),
+            "embedding_calls": embedding_calls,
+            "round_trips": round_trips,
+            "saved_embedding_calls": 2 * len(facts) - embedding_calls,
+            "saved_round_trips": 2 * len(facts) - round_trips,
+            "ids": ids
+        }
+        self.last_ingest_stats = stats
+        print(f"Batched ingest of {stats['facts']} facts: saved {stats['saved_embedding_calls']} embedding calls "
+              f"and {stats['saved_round_trips']} round-trips")
+        return stats
+
+    def _speculate_merges(self, facts, fact_distances, hits, new_metadata):
+        """Decide merges against the candidates each fact would see if all earlier
+        facts in the batch were added unchanged, sending the model calls to up to
+        merge_concurrency threads. Every fact's nearest candidate is judged first;
+        the second is only judged for facts whose nearest was not merged. Returns
+        decisions keyed by (fact index, candidate key, candidate document, candidate
+        overview) and the keys whose decision took a model call."""
+        candidates = []
+        assumed = {}
+        for q, new_info in enumerate(facts):
+            candidates.append(self._batch_candidates(hits[q], fact_distances[q], assumed, {}))
+            assumed[q] = {'document': new_info, 'metadata': self.generate_metadata(new_metadata), 'fact_index': q}
+
+        decisions = {}
+        speculated = set()
+        waiting = list(range(len(facts)))
+        for rank in range(2):
+            jobs = []
+            for q in waiting:
+                if rank >= len(candidates[q]):
+                    continue
+                item = candidates[q][rank]
+                key = (q, item['key'], item['document'], item['metadata']['source_overview'])
+                result = self._local_merge(item['document'], key[3], facts[q], item['distance'])
+                if result is None:
+                    jobs.append(key)
+                else:
+                    decisions[key] = result
+
+            def decide(key):
+                self._count_merge("speculative_llm_calls")
+                return self.decide_and_merge(key[2], key[3], facts[key[0]], new_metadata)
+
+            for key, result in zip(jobs, Utils.parallel_map(decide, jobs, self.merge_concurrency)):
+                decisions[key] = result
+                speculated.add(key)
+
+            waiting = [q for q in waiting if rank < len(candidates[q]) and not decisions[
+                (q, candidates[q][rank]['key'], candidates[q][rank]['document'],
+                 candidates[q][rank]['metadata']['source_overview'])]["merge_decision"]]
+        return decisions, speculated
+
+    def _batch_candidates(self, hits, distances, pending, updated, n_results=2):
+        """The n_results nearest of the collection hits and the rows added earlier in
+        the batch; distances holds this fact's distance to every fact in the batch."""
+        candidates = []
+        for item in hits:
+            if item['id'] in updated:
+                row = updated[item['id']]
+                item = dict(item, document=row['document'], metadata=row['metadata'])
+            candidates.append(dict(item, key=item['id']))
+
+        # Rows merged earlier in the batch are ranked by the fact they were added from.
+        for row_id, row in pending.items():
+            candidates.append({'id': row_id, 'key': ('fact', row['fact_index']), 'distance': distances[row['fact_index']],
+                               'document': row['document'], 'metadata': row['metadata']})
+
+        candidates.sort(key=lambda item: item['distance'])
+        return candidates[:n_results]
 
     def add_new_fact(self, fact):
         self.add_or_update_info(fact)
@@ -72,27 +369,61 @@ class MemoryManager:
             existing_info = item['document']
             existing_metadata = item['metadata']
             
-            result = self.decide_and_merge(existing_info, existing_metadata['source_overview'], new_info, new_metadata)
+            result = self.resolve_merge(existing_info, existing_metadata['source_overview'], new_info, new_metadata, item['distance'])
             
             if result["merge_decision"]:
                 existing_metadata['source_overview'] = result["merged_metadata"]
                 existing_metadata['last_updated'] = Utils.get_current_timestamp()
-                self.collection.update(
+                self._store_update(
                     ids=[item['id']],
                     documents=[result["merged_information"]],
                     metadatas=[existing_metadata]
                 )
                 print(f"Updated existing entry: {item['id']}")
                 print(f"Reason for merge: {result['reason']}")
-                return
+                return item['id']
         
-        new_id = f"{Utils.get_current_timestamp()}{new_info[:10]}"
-        self.collection.add(
-            ids=[new_id],
+        new_id, = self._store_add(
+            ids=[Utils.content_id(new_info)],
             documents=[new_info],
             metadatas=[self.generate_metadata(new_metadata)]
         )
         print(f"Added new entry: {new_id}")
+        return new_id
+
+    def resolve_merge(self, existing_info, existing_metadata, new_info, new_metadata, distance=None):
+        """Settle clear duplicates and clearly distinct neighbours locally and only send
+        the ambiguous distance band to decide_and_merge."""
+        result = self._local_merge(existing_info, existing_metadata, new_info, distance)
+        if result is not None:
+            return result
+        self._count_merge("llm_calls")
+        return self.decide_and_merge(existing_info, existing_metadata, new_info, new_metadata)
+
+    def _local_merge(self, existing_info, existing_metadata, new_info, distance=None):
+        """The merge decision when it needs no model call, otherwise None."""
+        if Utils.text_fingerprint(existing_info) == Utils.text_fingerprint(new_info) or (
+                distance is not None and distance <= self.duplicate_distance):
+            self._count_merge("local_duplicates")
+            return {
+                "merge_decision": True,
+                "reason": "duplicate of existing information",
+                "merged_metadata": existing_metadata,
+                "merged_information": existing_info
+            }
+        if distance is not None and distance >= self.distinct_distance:
+            self._count_merge("local_distinct")
+            return {
+                "merge_decision": False,
+                "reason": "distinct information",
+                "merged_metadata": None,
+                "merged_information": None
+            }
+        return None
+
+    def _count_merge(self, key, n=1):
+        with self._merge_stats_lock:
+            self.merge_stats[key] += n
 
     def decide_and_merge(self, existing_info, existing_metadata, new_info, new_metadata):
         prompt = f"""
@@ -134,53 +465,300 @@ class MemoryManager:
 
         result = response.choices[0].message.content.strip()
         print(f'existing={existing_info}\nnew={new_info}\n{result}')
-        try:
-            return Utils.extractValidJson(result)
-        except json.JSONDecodeError:
-            return {
-                "merge_decision": False,
-                "reason": "Failed to parse AI response",
-                "merged_metadata": None,
-                "merged_information": None
-            }
+        return Utils.extractValidJson(result, key="merge_decision") or {
+            "merge_decision": False,
+            "reason": "Failed to parse AI response",
+            "merged_metadata": None,
+            "merged_information": None
+        }
 
     def format_metadata(self, metadata):
         return '\n'.join([f"{k}: {v}" for k, v in metadata.items()])
 
-    def get_all_memories(self):
-        results = self.collection.get(
-            include=['metadatas', 'documents']
-        )
+    def get_all_memories(self, page_size=500):
+        import pandas as pd
+        ids, documents, metadatas = [], [], []
+        for record in self.iter_memories(page_size):
+            ids.append(record.id)
+            documents.append(record.document)
+            metadatas.append(record.metadata)
 
         df = pd.DataFrame({
-            'ID': results['ids'],
-            'Document': results['documents'],
-            'Metadata': results['metadatas']
+            'ID': ids,
+            'Document': documents,
+            'Metadata': metadatas
         })
 
         df['Metadata'] = df['Metadata'].apply(self.format_metadata)
 
         return df
 
-    def search_memories(self, query_text, n_results=5):
-        results = self.collection.query(
-            query_texts=[query_text],
-            n_results=n_results,
-            include=['metadatas', 'documents', 'distances']
+    def get_memories_page(self, limit=100, offset=0):
+        """One page of stored memories as MemoryRecords (without distances), plus the
+        offset of the next page, or None when this is the last one."""
+        results = self.collection.get(limit=limit, offset=offset, include=['metadatas', 'documents'])
+        records = tuple(
+            MemoryRecord(id, None, document, metadata)
+            for id, document, metadata in zip(results['ids'], results['documents'], results['metadatas'])
         )
-        
-        formatted_results = Utils.format_chroma_results(results)
-        
-        df = pd.DataFrame(formatted_results)
-        if not df.empty:
-            df['metadata'] = df['metadata'].apply(self.format_metadata)
-            column_order = ['id', 'distance', 'document', 'metadata']
-            df = df.reindex(columns=[col for col in column_order if col in df.columns])
-        return df
+        next_offset = offset + len(records)
+        if not records or next_offset >= self.collection.count():
+            next_offset = None
+        return records, next_offset
+
+    def iter_memories(self, page_size=500):
+        """Yield every stored memory, fetching page_size rows at a time."""
+        offset = 0
+        while offset is not None:
+            records, offset = self.get_memories_page(page_size, offset)
+            yield from records
+
+    # All writes go through these, so the version counter and the lexical index
+    # always follow the collection.
+    def _store_add(self, ids, documents, metadatas, embeddings=None):
+        """Add entries and return the id each one is stored under. The stores silently
+        skip ids that exist, and a content id can already name other text (the entry
+        made from this text was since merged into something else). So an id already
+        holding the same text is a duplicate and is not written, and an id holding
+        other text is replaced by a fresh one."""
+        existing = self.collection.get(ids=list(ids), include=['documents'])
+        existing = {id: Utils.text_fingerprint(document) for id, document in zip(existing['ids'], existing['documents'])}
+        stored_ids = []
+        rows = []
+        for i, (id, document) in enumerate(zip(ids, documents)):
+            if id in existing:
+                if existing[id] == Utils.text_fingerprint(document):
+                    stored_ids.append(id)
+                    continue
+                id = f"{id}-{uuid.uuid4().hex[:8]}"
+            stored_ids.append(id)
+            rows.append((i, id))
+        if not rows:
+            return stored_ids
+
+        new_ids = [id for _, id in rows]
+        documents = [documents[i] for i, _ in rows]
+        metadatas = [metadatas[i] for i, _ in rows]
+        if embeddings is not None:
+            embeddings = [embeddings[i] for i, _ in rows]
+        self.collection.add(ids=new_ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        if self._lexical is not None:
+            self._lexical.add(new_ids, documents, metadatas)
+        self._bump_version()
+        return stored_ids
+
+    def _store_update(self, ids, documents=None, metadatas=None, embeddings=None):
+        self.collection.update(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        if self._lexical is not None:
+            self._lexical.update(ids, documents, metadatas)
+        self._bump_version()
+
+    def _store_delete(self, ids):
+        self.collection.delete(ids=ids)
+        if self._lexical is not None:
+            self._lexical.delete(ids)
+        if self.registry is not None:
+            self.registry.forget_facts(self.store_key, ids)
+        self._bump_version()
+
+    def _store_clear(self):
+        self.collection.clear()
+        if self._lexical is not None:
+            self._lexical = BM25Index()
+        if self.registry is not None:
+            self.registry.forget_scope(self.store_key)
+        self._bump_version()
+
+    @property
+    def version(self):
+        return self.version_marker.read()
+
+    def _bump_version(self):
+        before = self.version_marker.read()
+        token = self.version_marker.bump()
+        # Only this process wrote since the last sync, and its state already has the write.
+        if before == self._synced_version:
+            self._synced_version = token
+
+    def _sync_external_writes(self):
+        """Returns the current version. When another process has written to the
+        collection since this one last looked, the store is reopened and the lexical
+        index dropped, so both are rebuilt from what is on disk now."""
+        version = self.version
+        if version != self._synced_version:
+            with self._lexical_lock:
+                if version != self._synced_version:
+                    if self._collection is not None and self._synced_version is not None:
+                        self._collection.refresh()
+                    self._lexical = None
+                    self._synced_version = version
+        return version
+
+    @property
+    def lexical_index(self):
+        """BM25 index over the stored documents, built from the collection on first use
+        and again after another process writes to it."""
+        self._sync_external_writes()
+        if self._lexical is None:
+            with self._lexical_lock:
+                if self._lexical is None:
+                    index = BM25Index()
+                    offset = 0
+                    while offset is not None:
+                        records, offset = self.get_memories_page(1000, offset)
+                        index.add([r.id for r in records], [r.document for r in records],
+                                  [r.metadata for r in records])
+                    self._lexical = index
+        return self._lexical
+
+    def hybrid_search_batch(self, query_texts, n_results=5):
+        """Search for short queries such as form field names by fusing BM25 and vector
+        rankings. A query whose best lexical hit contains every query term (directly
+        or through FIELD_ALIASES) and outscores the next hit by lexical_margin is
+        answered from the index alone and costs no embedding; the rest share one
+        search_records_batch call. Lexical hits are read back from the collection
+        by id, so they are never older than the stored entries."""
+        index = self.lexical_index
+        lexical = {q: index.search(expand_query(q), n_results) for q in dict.fromkeys(query_texts)}
+        stored = self.collection.get(ids=list({id for hits in lexical.values() for id, _, _ in hits}),
+                                     include=['metadatas', 'documents'])
+        stored = {id: MemoryRecord(id, None, document, metadata)
+                  for id, document, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])}
+        lexical = {q: [hit for hit in hits if hit[0] in stored] for q, hits in lexical.items()}
+
+        confident = {q for q, hits in lexical.items() if hits and hits[0][2] and (
+            len(hits) == 1 or hits[0][1] >= self.lexical_margin * hits[1][1])}
+        uncertain = [q for q in lexical if q not in confident]
+        vector = dict(zip(uncertain, self.search_records_batch(uncertain, n_results))) if uncertain else {}
+
+        self.retrieval_stats["queries"] += len(lexical)
+        self.retrieval_stats["lexical_only"] += len(confident)
+
+        found = {}
+        for q, hits in lexical.items():
+            records = {r.id: r for r in vector.get(q, ())}
+            ranking = [id for id, _, _ in hits]
+            if q not in confident:
+                ranking = reciprocal_rank_fusion([list(records), ranking])
+            found[q] = [records.get(id) or stored[id] for id in ranking[:n_results]]
+        return [found[q] for q in query_texts]
+
+    def search_memories(self, query_text, n_results=5):
+        """DataFrame view of search_records, for the console tables."""
+        import pandas as pd
+        records = self.search_records(query_text, n_results)
+        if not records:
+            return pd.DataFrame()
+        return pd.DataFrame({
+            'id': [r.id for r in records],
+            'distance': [r.distance for r in records],
+            'document': [r.document for r in records],
+            'metadata': [r.metadata_text() for r in records]
+        })
+
+    def search_records(self, query_text, n_results=5):
+        return self.search_records_batch([query_text], n_results)[0]
+
+    def search_records_batch(self, query_texts, n_results=5):
+        """Search for several queries at once: cached queries are answered locally and
+        the rest share one embedding call and one collection.query. Returns a list
+        of MemoryRecord per query, in order."""
+        version = self._sync_external_writes()
+        found = {}
+        for query_text in dict.fromkeys(query_texts):
+            cached = self.query_cache.get((query_text, n_results), version)
+            if cached is not None:
+                found[query_text] = cached
+
+        missing = [q for q in dict.fromkeys(query_texts) if q not in found]
+        if missing:
+            results = self.collection.query(
+                query_texts=missing,
+                n_results=n_results,
+                include=['metadatas', 'documents', 'distances']
+            )
+            for i, query_text in enumerate(missing):
+                found[query_text] = MemoryRecord.from_chroma(results, i)
+                self.query_cache.put((query_text, n_results), version, found[query_text])
+
+        return [found[q] for q in query_texts]
+
+    def export_snapshot(self, path, chunk_size=5000):
+        """Write every entry to a snapshot directory: manifest.json, embeddings.npy
+        (float32 rows, loadable with mmap) and records.jsonl with one
+        [id, document, metadata] line per row, in the same order."""
+        import numpy as np
+
+        os.makedirs(path, exist_ok=True)
+        total = self.collection.count()
+        embeddings = None
+        written = 0
+        with open(os.path.join(path, "records.jsonl"), "w") as records:
+            while written < total:
+                page = self.collection.get(limit=chunk_size, offset=written,
+                                           include=['metadatas', 'documents', 'embeddings'])
+                if not page['ids']:
+                    break
+                vectors = np.asarray(page['embeddings'], dtype=np.float32)
+                if embeddings is None:
+                    embeddings = np.lib.format.open_memmap(os.path.join(path, "embeddings.npy"), mode='w+',
+                                                           dtype=np.float32, shape=(total, vectors.shape[1]))
+                embeddings[written:written + len(vectors)] = vectors
+                for row in zip(page['ids'], page['documents'], page['metadatas']):
+                    records.write(json.dumps(row) + "\n")
+                written += len(page['ids'])
+
+        dim = 0
+        if embeddings is not None:
+            dim = embeddings.shape[1]
+            embeddings.flush()
+            del embeddings
+        with open(os.path.join(path, "manifest.json"), "w") as f:
+            json.dump({
+                "format": "formfiller-snapshot",
+                "version": 1,
+                "count": written,
+                "dim": dim,
+                "embedding_model": self.embedding_model,
+                "created_at": Utils.get_current_timestamp()
+            }, f, indent=2)
+        print(f"Exported {written} entries to {path}")
+        return written
+
+    def import_snapshot(self, path, chunk_size=5000):
+        """Bulk-load a snapshot written by export_snapshot, reusing its stored
+        embeddings, so nothing is embedded or merged through the LLM. Entries already
+        in the collection are skipped; a row whose id now names other text is
+        added under a fresh id."""
+        import numpy as np
+
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != "formfiller-snapshot":
+            raise ValueError(f"{path} is not a knowledge base snapshot")
+        if manifest["embedding_model"] != self.embedding_model:
+            raise ValueError(f"Snapshot embeddings come from {manifest['embedding_model']}, "
+                             f"this knowledge base uses {self.embedding_model}")
+        if manifest["count"] == 0:
+            return 0
+
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        loaded = 0
+        with open(os.path.join(path, "records.jsonl")) as records:
+            while loaded < manifest["count"]:
+                rows = [json.loads(line) for _, line in zip(range(chunk_size), records)]
+                if not rows:
+                    break
+                ids, documents, metadatas = (list(column) for column in zip(*rows))
+                self._store_add(ids, documents, metadatas,
+                                embeddings=embeddings[loaded:loaded + len(rows)].tolist())
+                loaded += len(rows)
+        print(f"Imported {loaded} entries from {path}")
+        return loaded
 
     def delete_entry(self, entry_id):
         try:
-            self.collection.delete(ids=[entry_id])
+            self._store_delete([entry_id])
             print(f"Deleted entry with ID: {entry_id}")
             return True
         except Exception as e:
@@ -188,7 +766,6 @@ class MemoryManager:
             return False
 
     def delete_all_entries(self):
-        all_ids = self.collection.get()['ids']
-        print(all_ids)
-        self.collection.delete(ids=all_ids)
-        print(f"Deleted {len(all_ids)} entries from collection ")
+        deleted = self.collection.count()
+        self._store_clear()
+        print(f"Deleted {deleted} entries from collection ")
@@ -0,0 +1,87 @@
+import math
+from Tokenizer import count_tokens
+
+# Token budget per prompt for each model. Not the context window: prompts are
+# kept small enough for the model to answer every field in them carefully.
+PROMPT_BUDGETS = {
+    "gpt-4o": 4000,
+    "gpt-4o-mini": 4000,
+}
+
+class BatchPacker:
+    """Packs prompt items into as few batches as fit a token budget, in order.
+
+    An item is (tokens, shared), where shared lists (key, tokens) context entries
+    such as retrieved memories. An entry already in the batch costs nothing again.
+    The cost of a run of items can only grow as the run is extended, so filling
+    each batch as far as it goes yields the fewest batches of any order-preserving
+    split.
+    Token counts are cached by text, since field names and memories repeat."""
+
+    def __init__(self, model="gpt-4o", budget=None, max_cached=100000):
+        self.model = model
+        self.budget = budget or PROMPT_BUDGETS.get(model, 4000)
+        self.max_cached = max_cached
+        self._counts = {}
+        self.last_stats = None
+
+    def count(self, text):
+        tokens = self._counts.get(text)
+        if tokens is None:
+            if len(self._counts) >= self.max_cached:
+                self._counts.clear()
+            tokens = self._counts[text] = count_tokens(text, self.model)
+        return tokens
+
+    def count_value(self, value):
+        """Approximate tokens of value once serialized into a prompt as JSON, without
+        serializing it: counted piece by piece, plus a few tokens of punctuation."""
+        if isinstance(value, dict):
+            return 2 + sum(self.count(str(key)) + self.count_value(item) + 3 for key, item in value.items())
+        if isinstance(value, (list, tuple)):
+            return 2 + sum(self.count_value(item) + 1 for item in value)
+        return self.count(str(value)) + 1
+
+    def pack(self, items):
+        """Returns batches as (item indices, shared keys) pairs, shared keys in first-use
+        order, and records the packing efficiency in last_stats."""
+        batches = []
+        indices, keys, seen = [], [], set()
+        used = 0
+        total = 0
+        for i, (item_tokens, shared) in enumerate(items):
+            shared = dict(shared)
+            fresh = [key for key in shared if key not in seen]
+            cost = item_tokens + sum(shared[key] for key in fresh)
+            if indices and used + cost > self.budget:
+                batches.append((indices, keys))
+                total += used
+                indices, keys, seen = [], [], set()
+                fresh = list(shared)
+                cost = item_tokens + sum(shared.values())
+                used = 0
+            indices.append(i)
+            keys.extend(fresh)
+            seen.update(fresh)
+            used += cost
+        if indices:
+            batches.append((indices, keys))
+            total += used
+
+        self.last_stats = {
+            "items": len(items),
+            "batches": len(batches),
+            "tokens": total,
+            "budget": self.budget,
+            # Batches needed if the tokens could be split anywhere.
+            "lower_bound": math.ceil(total / self.budget) if total else 0,
+            "fill": total / (len(batches) * self.budget) if batches else 0.0
+        }
+        return batches
+
+    def report(self):
+        stats = self.last_stats
+        if not stats or not stats["batches"]:
+            return "Nothing to pack."
+        return (f"Packed {stats['items']} items into {stats['batches']} batches "
+                f"(at least {stats['lower_bound']} needed), {stats['fill']:.0%} of the {stats['budget']}-token budget used")
@@ -1,29 +1,154 @@
+import io
 import os
 import re
 import base64
-import requests
-from pdf2image import convert_from_path
+import hashlib
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
 from Util import Utils
+from Cache import DiskLRUCache
+from FormFields import extract_form_questions
+from Tokenizer import count_tokens
 from tqdm import tqdm
-from openai import OpenAI
+
+# JPEG settings for page images sent to the vision model. gpt-4o scales high-detail
+# images to fit 2048x2048 and then to 768px on the short side, so pixels beyond that
+# only cost upload time. "original" is what pages were sent as before profiles.
+IMAGE_PROFILES = {
+    "original": {"max_short_side": None, "quality": 75, "grayscale": False},
+    "text": {"max_short_side": 768, "quality": 60, "grayscale": True},
+    "dense": {"max_short_side": 768, "quality": 80, "grayscale": True},
+    "color": {"max_short_side": 768, "quality": 75, "grayscale": False},
+}
 
 class Preprocessor:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, registry=None, batch_size=3, render_workers=2, dpi=200,
+                 vision_concurrency=4, vision_retries=2, retry_backoff=1.0, image_profile="auto",
+                 max_short_side=None, jpeg_quality=None, grayscale=None, cache_dir="cache",
+                 vision_cache_bytes=64 * 1024 * 1024):
         self.page_pattern = re.compile(r'\bPage\s+\d+', re.IGNORECASE)
-        if api_key:
-            self.client = OpenAI(api_key=api_key)
-        else:
-            self.client = OpenAI()
+        self.api_key = api_key
+        self.vision_model = "gpt-4o"
+        # Pages go to the vision model batch_size at a time. Up to render_workers
+        # batches are rasterized ahead of the one being analyzed.
+        self.batch_size = batch_size
+        self.render_workers = render_workers
+        self.dpi = dpi
+        # Page batches analyzed at once, and how often a failed batch is retried.
+        self.vision_concurrency = vision_concurrency
+        self.vision_retries = vision_retries
+        self.retry_backoff = retry_backoff
+        # "auto" picks an IMAGE_PROFILES entry per page; the other arguments, when
+        # given, override what the profile says.
+        self.image_profile = image_profile
+        self.image_overrides = {key: value for key, value in
+                                (("max_short_side", max_short_side), ("quality", jpeg_quality), ("grayscale", grayscale))
+                                if value is not None}
+        self.image_stats = {"pages": 0, "bytes": 0, "encode_seconds": 0.0, "profiles": {}}
+        self._image_stats_lock = threading.Lock()
+        # Vision output per page batch, kept on disk so re-processed documents and
+        # pages shared between forms skip the call. cache_dir=None disables it.
+        self.cache_dir = cache_dir
+        self.vision_cache_bytes = vision_cache_bytes
+        self._vision_cache = None
+        # Optional IngestRegistry; when set, question sets for PDF forms are stored
+        # by file content and reused across runs, processes and renamed copies.
+        self.registry = registry
+        self._form_locks = {}
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # openai is imported on first use to keep startup cheap.
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI(api_key=self.api_key) if self.api_key else OpenAI()
+        return self._client
+
+    @property
+    def vision_cache(self):
+        if self._vision_cache is None and self.cache_dir is not None:
+            with self._client_lock:
+                if self._vision_cache is None:
+                    self._vision_cache = DiskLRUCache(os.path.join(self.cache_dir, "vision.sqlite3"),
+                                                      self.vision_cache_bytes)
+        return self._vision_cache
 
     @staticmethod
-    def encode_image(image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    def image_bytes(image):
+        """The encoded bytes of an image given as JPEG bytes, a BytesIO (read through
+        its buffer, without copying) or the path of an image file."""
+        if isinstance(image, io.BytesIO):
+            return image.getbuffer()
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return image
+        with open(image, "rb") as image_file:
+            return image_file.read()
+
+    @staticmethod
+    def encode_image(image):
+        return base64.b64encode(Preprocessor.image_bytes(image)).decode('ascii')
+
+    @staticmethod
+    def image_to_jpeg(image, quality=75, grayscale=False, max_short_side=None):
+        """Encode a PIL page image as JPEG into memory, optionally downscaled so its
+        short side is at most max_short_side and converted to grayscale."""
+        # Convert first so a grayscale page is resized on one channel instead of three.
+        image = image.convert("L" if grayscale else "RGB")
+        if max_short_side and min(image.size) > max_short_side:
+            scale = max_short_side / min(image.size)
+            image = image.resize((round(image.width * scale), round(image.height * scale)),
+                                 resample=3, reducing_gap=2.0)  # bicubic
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+        return buffer
+
+    @staticmethod
+    def classify_page(image):
+        """Pick an image profile from a thumbnail: "color" when the page has visible
+        colour, otherwise "dense" or "text" by the share of dark (ink) pixels."""
+        thumbnail = image.copy()
+        thumbnail.thumbnail((128, 128))
+        saturation = thumbnail.convert("RGB").convert("HSV").getchannel("S").histogram()
+        pixels = sum(saturation)
+        if sum(count for level, count in enumerate(saturation) if level > 60) / pixels > 0.02:
+            return "color"
+        # Text is averaged to grey in the thumbnail, so count anything short of white.
+        luminance = thumbnail.convert("L").histogram()
+        return "dense" if sum(luminance[:230]) / pixels > 0.15 else "text"
+
+    def encode_page(self, image):
+        """JPEG buffer for a rendered page under the configured profile, counted in
+        image_stats."""
+        start = time.perf_counter()
+        profile = self.classify_page(image) if self.image_profile == "auto" else self.image_profile
+        buffer = self.image_to_jpeg(image, **dict(IMAGE_PROFILES[profile], **self.image_overrides))
+        elapsed = time.perf_counter() - start
+        with self._image_stats_lock:
+            self.image_stats["pages"] += 1
+            self.image_stats["bytes"] += buffer.getbuffer().nbytes
+            self.image_stats["encode_seconds"] += elapsed
+            self.image_stats["profiles"][profile] = self.image_stats["profiles"].get(profile, 0) + 1
+        return buffer
+
+    def image_report(self):
+        stats = self.image_stats
+        if not stats["pages"]:
+            return "No pages encoded."
+        return (f"Encoded {stats['pages']} pages: {stats['bytes'] / stats['pages'] / 1024:.0f} KB/page, "
+                f"{stats['encode_seconds'] / stats['pages'] * 1000:.0f} ms/page, profiles {stats['profiles']}")
 
     @staticmethod
     def extract_text_from_url(url):
+        import requests
+        from bs4 import BeautifulSoup
         response = requests.get(url)
         soup = BeautifulSoup(response.text, 'html.parser')
         return soup.get_text()
@@ -32,12 +157,12 @@ class Preprocessor:
         image_contents = [
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{self.encode_image(img_path)}"}
-            } for img_path in image_batch
+                "image_url": {"url": f"data:image/jpeg;base64,{self.encode_image(image)}"}
+            } for image in image_batch
         ]
         
         response = self.client.chat.completions.create(
-            model="gpt-4o",
+            model=self.vision_model,
             messages=[
                 {
                     "role": "user",
@@ -66,12 +191,12 @@ class Preprocessor:
         image_contents = [
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{self.encode_image(img_path)}"}
-            } for img_path in image_batch
+                "image_url": {"url": f"data:image/jpeg;base64,{self.encode_image(image)}"}
+            } for image in image_batch
         ]
         
         response = self.client.chat.completions.create(
-            model="gpt-4o",
+            model=self.vision_model,
             messages=[
                 {
                     "role": "user",
@@ -126,8 +251,43 @@ class Preprocessor:
         return response.choices[0].message.content
 
     def process_pdf_form(self, file_path, comment) -> dict:
+        """Questions of a form, generated once per file content and then read from the
+        registry. The stored set is keyed by the file alone, so a later request with
+        a different comment gets the questions generated for the first one."""
+        if self.registry is None:
+            return self.generate_form_questions(file_path, comment)
+
+        fingerprint = Utils.file_fingerprint(file_path)
+        with self._client_lock:
+            lock = self._form_locks.setdefault(fingerprint, threading.Lock())
+        # Concurrent requests for the same form wait for the first one instead of
+        # generating the questions again.
+        try:
+            with lock:
+                questions = self.registry.get_form_questions(fingerprint)
+                if questions is not None:
+                    tqdm.write(f"Reusing {len(questions['questions'])} stored questions for {file_path}.")
+                    return questions
+                questions = self.generate_form_questions(file_path, comment)
+                if questions["questions"]:
+                    self.registry.record_form_questions(fingerprint, file_path, questions)
+            return questions
+        finally:
+            # Once the set is recorded the registry answers later requests; holding
+            # on to the lock would keep one entry per form ever seen.
+            with self._client_lock:
+                if self._form_locks.get(fingerprint) is lock:
+                    del self._form_locks[fingerprint]
+
+    def generate_form_questions(self, file_path, comment) -> dict:
+        # Fillable PDFs name their own fields; vision is only needed for scanned or flat ones.
+        form_questions = extract_form_questions(file_path)
+        if form_questions is not None:
+            tqdm.write(f"Read {len(form_questions['questions'])} form fields from the PDF, skipping vision.")
+            return form_questions
+
         questions = self.process_pdf(file_path, comment, self.extract_questions_from_form)
-        questions = [Utils.extractValidJson(q) for q in questions]
+        questions = [Utils.extractValidJson(q, key="questions") for q in questions]
         questions = [q for q in questions if q is not None]
         combined_questions = {"questions": []}
         for item in questions:
@@ -135,26 +295,86 @@ class Preprocessor:
         
         return combined_questions
 
+    @staticmethod
+    def page_ranges(page_count, batch_size):
+        return [(first, min(first + batch_size - 1, page_count)) for first in range(1, page_count + 1, batch_size)]
+
+    def iter_page_batches(self, file_path, batch_size=None, workers=None, dpi=None, page_count=None):
+        """Yield the pages of a PDF as lists of PIL images, batch_size pages at a time
+        and in page order. Each batch is rasterized separately with first_page and
+        last_page. Up to workers batches render concurrently; each one runs in its
+        own pdftoppm process. No more batches are started than the consumer has
+        room for, so memory stays bounded by the window and not by the page count."""
+        from pdf2image import convert_from_path, pdfinfo_from_path
+        batch_size = batch_size or self.batch_size
+        workers = max(1, workers or self.render_workers)
+        dpi = dpi or self.dpi
+
+        if page_count is None:
+            page_count = pdfinfo_from_path(file_path)["Pages"]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for first, last in self.page_ranges(page_count, batch_size):
+                pending.append(executor.submit(convert_from_path, file_path, dpi=dpi, first_page=first, last_page=last))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
     def process_pdf(self, file_path, comment, process_func) -> list[str]:
-        images = convert_from_path(file_path)
-        temp_image_paths = []
-        for i, image in enumerate(tqdm(images, desc="Converting PDF to images", unit="page")):
-            temp_path = f"temp_image_{i}.jpg"
-            image.save(temp_path, "JPEG")
-            temp_image_paths.append(temp_path)
-        
-        batch_size = 3
-        summaries = []
-        for i in tqdm(range(0, len(temp_image_paths), batch_size), desc="Analyzing PDF pages", unit="batch"):
-            batch = temp_image_paths[i:i+batch_size]
-            batch_summary = process_func(batch, comment)
-            summaries.append(batch_summary)
-
-        # Clean up temporary files
-        for temp_path in temp_image_paths:
-            os.remove(temp_path)
+        from pdf2image import pdfinfo_from_path
+        page_count = pdfinfo_from_path(file_path)["Pages"]
+        batch_count = len(self.page_ranges(page_count, self.batch_size))
+
+        # Pages stay in memory as JPEG buffers; nothing is written to disk.
+        batches = (
+            [self.encode_page(image) for image in images]
+            for images in self.iter_page_batches(file_path, page_count=page_count)
+        )
+        summaries = self.analyze_batches(batches, comment, process_func, batch_count)
+        tqdm.write(self.image_report())
+        if self.vision_cache is not None:
+            stats = self.vision_cache.stats()
+            tqdm.write(f"Vision cache: {stats['hits']} hits, {stats['misses']} misses")
         return summaries
 
+    def analyze_batches(self, batches, comment, process_func, batch_count=None) -> list[str]:
+        """Run process_func over page batches on up to vision_concurrency threads and
+        return the outputs in page order. Batches are pulled from the iterable only
+        as threads free up, so rendering stays just ahead of the vision calls."""
+        summaries = {}
+        with tqdm(total=batch_count, desc="Analyzing PDF pages", unit="batch") as progress:
+            for index, summary in Utils.bounded_map(lambda batch: self.analyze_batch(batch, comment, process_func),
+                                                    batches, self.vision_concurrency):
+                summaries[index] = summary
+                progress.update()
+        return [summaries[index] for index in range(len(summaries))]
+
+    def analyze_batch(self, batch, comment, process_func):
+        """process_func on one batch, answered from the vision cache when the same
+        pages were analyzed before with the same prompt, model and description, and
+        retried with exponential backoff when it fails."""
+        cache = self.vision_cache
+        key = self.hash_pages(batch, process_func.__name__, self.vision_model, comment) if cache else None
+        if key:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached.decode('utf-8')
+
+        batch_summary = Utils.call_with_retries(
+            process_func, batch, comment, retries=self.vision_retries, backoff=self.retry_backoff,
+            on_retry=lambda e: tqdm.write(f"Page batch failed ({e}), retrying"))
+        if key and batch_summary is not None:
+            cache.set(key, batch_summary.encode('utf-8'))
+        return batch_summary
+
+    @staticmethod
+    def hash_pages(images, kind, model, comment):
+        digest = hashlib.sha256(f"{kind}\0{model}\0{comment}".encode('utf-8'))
+        for image in images:
+            digest.update(hashlib.sha256(Preprocessor.image_bytes(image)).digest())
+        return digest.hexdigest()
+
     def extract_knowledge(self, file_path, comment, tmp_file_path="temp.txt"):
         _, file_extension = os.path.splitext(file_path)
         
@@ -162,7 +382,10 @@ class Preprocessor:
             summaries = self.process_pdf(file_path, comment, self.process_image_batch)
             content = "\n\n".join(summaries)
         elif file_extension.lower() in ['.jpg', '.jpeg', '.png']:
-            content = self.process_image_batch([file_path], comment)
+            from PIL import Image
+            with Image.open(file_path) as image:
+                page = self.encode_page(image)
+            content = self.analyze_batch([page], comment, self.process_image_batch)
         elif file_extension.lower() in ['.txt', '.md']:
             with open(file_path, 'r') as file:
                 content = file.read()
@@ -174,8 +397,6 @@ class Preprocessor:
         with open(tmp_file_path, "w") as f:
             f.write(content)
         return content
-    
-    import re
 
     def extract_summaries(self, lines):
         start_summary = []
@@ -205,41 +426,38 @@ class Preprocessor:
     def create_batch(self, content, start_summary, end_summary):
         return '\n'.join(start_summary + content + end_summary)
 
-    def split_content(self, content, lines_per_batch=200, overlap=5):
+    def split_content(self, content, max_tokens=3000, overlap=5, model="gpt-4o"):
+        """Yield batches of content for generate_knowledges, the start and end summaries
+        repeated in each, with at most max_tokens tokens (as counted for model) per
+        batch. A batch that fills up a few lines (at most overlap) before a page break
+        runs on to the break, so pages are not cut in two. Each line is counted once
+        and page breaks are found by bisect, so the split is linear in the length of
+        the document."""
         lines = content.split('\n')
         start_summary, main_content, end_summary = self.extract_summaries(lines)
         page_breaks = self.find_page_breaks(main_content)
+        summary_tokens = count_tokens('\n'.join(start_summary + end_summary), model)
+        budget = max(max_tokens - summary_tokens, max_tokens // 4)
 
-        batches = []
         current_batch = []
-        current_line_count = 0
-
-        def add_to_batch(line):
-            nonlocal current_batch, current_line_count
-            current_batch.append(line)
-            current_line_count += 1
-
-        def finalize_batch():
-            nonlocal current_batch, current_line_count, batches
+        current_tokens = 0
+        split_at = None
+        for i, line in enumerate(main_content):
+            line_tokens = count_tokens(line, model) + 1  # + the newline
             if current_batch:
-                batches.append(self.create_batch(current_batch, start_summary, end_summary))
-                current_batch = []
-                current_line_count = 0
+                if i == split_at:
+                    yield self.create_batch(current_batch, start_summary, end_summary)
+                    current_batch, current_tokens, split_at = [], 0, None
+                elif split_at is None and current_tokens + line_tokens > budget:
+                    # Full: split here, unless a page starts within overlap lines.
+                    next_break = bisect_left(page_breaks, i)
+                    if next_break < len(page_breaks) and 0 < page_breaks[next_break] - i <= overlap:
+                        split_at = page_breaks[next_break]
+                    else:
+                        yield self.create_batch(current_batch, start_summary, end_summary)
+                        current_batch, current_tokens = [], 0
+            current_batch.append(line)
+            current_tokens += line_tokens
 
-        for i, line in enumerate(main_content):
-            if i in page_breaks:
-                if current_line_count >= lines_per_batch:
-                    finalize_batch()
-                elif current_line_count > 0:
-                    add_to_batch(line)
-                    continue
-
-            add_to_batch(line)
-
-            if current_line_count >= lines_per_batch:
-                next_page_break = next((pb for pb in page_breaks if pb > i), None)
-                if next_page_break is None or next_page_break - i > overlap:
-                    finalize_batch()
-
-        finalize_batch()  # Add any remaining content as the last batch
-        return batches
\ No newline at end of file
+        if current_batch:
+            yield self.create_batch(current_batch, start_summary, end_summary)
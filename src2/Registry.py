@@ -0,0 +1,99 @@
+import os
+import json
+import sqlite3
+import threading
+from Util import Utils
+
+class IngestRegistry:
+    """Persistent record of what has already been ingested, so re-uploading a file
+    only pays for what changed:
+
+    - documents: source-file fingerprint -> ids of the facts it produced
+    - batches: hash of a text batch fed to generate_knowledges -> fact ids
+    - form_questions: PDF fingerprint -> the question set generated for the form
+
+    Documents and batches are kept per scope (MemoryManager.store_key), since the
+    same file ingested into another collection still has to be processed there.
+    Fact ids are only a hint: callers check that they still exist before skipping.
+
+    WAL mode and a busy timeout let the console and several server processes share
+    the file; within a process a lock serializes access to the connection.
+    """
+
+    def __init__(self, path=os.path.join("cache", "ingest_registry.sqlite3")):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Rows written before documents and batches were scoped cannot be attributed
+        # to a collection; they only save work, so they are dropped.
+        for table in ("documents", "batches"):
+            columns = [row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+            if columns and "scope" not in columns:
+                self._conn.execute(f"DROP TABLE {table}")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                scope TEXT, fingerprint TEXT, source TEXT, comment TEXT, fact_ids TEXT NOT NULL, ingested_at TEXT,
+                PRIMARY KEY (scope, fingerprint));
+            CREATE TABLE IF NOT EXISTS batches (
+                scope TEXT, hash TEXT, fact_ids TEXT NOT NULL, PRIMARY KEY (scope, hash));
+            CREATE TABLE IF NOT EXISTS form_questions (
+                fingerprint TEXT PRIMARY KEY, source TEXT, questions TEXT NOT NULL, created_at TEXT);
+        """)
+        self._conn.commit()
+
+    def _fetch(self, query, *key):
+        with self._lock:
+            row = self._conn.execute(query, key).fetchone()
+        return row[0] if row else None
+
+    def _store(self, query, values):
+        with self._lock:
+            self._conn.execute(query, values)
+            self._conn.commit()
+
+    def get_document(self, scope, fingerprint):
+        fact_ids = self._fetch("SELECT fact_ids FROM documents WHERE scope = ? AND fingerprint = ?", scope, fingerprint)
+        return None if fact_ids is None else json.loads(fact_ids)
+
+    def record_document(self, scope, fingerprint, source, comment, fact_ids):
+        self._store("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, fingerprint, source, comment, json.dumps(fact_ids), Utils.get_current_timestamp()))
+
+    def get_batch(self, scope, batch_hash):
+        fact_ids = self._fetch("SELECT fact_ids FROM batches WHERE scope = ? AND hash = ?", scope, batch_hash)
+        return None if fact_ids is None else json.loads(fact_ids)
+
+    def record_batch(self, scope, batch_hash, fact_ids):
+        self._store("INSERT OR REPLACE INTO batches VALUES (?, ?, ?)", (scope, batch_hash, json.dumps(fact_ids)))
+
+    def forget_facts(self, scope, fact_ids):
+        """Drop the documents and batches that produced any of fact_ids."""
+        fact_ids = list(fact_ids)
+        with self._lock:
+            for i in range(0, len(fact_ids), 500):
+                chunk = fact_ids[i:i+500]
+                for table in ("documents", "batches"):
+                    self._conn.execute(
+                        f"DELETE FROM {table} WHERE scope = ? AND EXISTS ("
+                        f"SELECT 1 FROM json_each({table}.fact_ids) WHERE value IN ({','.join('?' * len(chunk))}))",
+                        [scope] + chunk
+                    )
+            self._conn.commit()
+
+    def forget_scope(self, scope):
+        with self._lock:
+            for table in ("documents", "batches"):
+                self._conn.execute(f"DELETE FROM {table} WHERE scope = ?", (scope,))
+            self._conn.commit()
+
+    def get_form_questions(self, fingerprint):
+        questions = self._fetch("SELECT questions FROM form_questions WHERE fingerprint = ?", fingerprint)
+        return None if questions is None else json.loads(questions)
+
+    def record_form_questions(self, fingerprint, source, questions):
+        self._store("INSERT OR REPLACE INTO form_questions VALUES (?, ?, ?, ?)",
+                    (fingerprint, source, json.dumps(questions), Utils.get_current_timestamp()))
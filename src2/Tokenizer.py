@@ -0,0 +1,34 @@
+import re
+import threading
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+def get_encoding(model):
+    """The tiktoken encoding for model, or None when tiktoken is not installed or its
+    encoding files cannot be loaded (they are downloaded on first use)."""
+    if model not in _encodings:
+        with _encodings_lock:
+            if model not in _encodings:
+                try:
+                    import tiktoken
+                    try:
+                        encoding = tiktoken.encoding_for_model(model)
+                    except KeyError:
+                        encoding = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    encoding = None
+                _encodings[model] = encoding
+    return _encodings[model]
+
+def estimate_tokens(text):
+    """Rough count for when no encoding is available: about four characters per
+    token, but never fewer than the number of words and punctuation marks."""
+    return max((len(text) + 3) // 4, len(_WORD.findall(text)))
+
+def count_tokens(text, model="gpt-4o"):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -1,41 +1,249 @@
 import re
 import json
+import time
+import hashlib
 import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# A JSON string literal (which cannot span lines) or a brace. Unterminated quotes in
+# prose fail to match at the end of their line, so scanning stays linear.
+_JSON_TOKEN = re.compile(r'"(?:[^"\\\n]|\\.)*"|[{}]')
+_CODE_FENCE = re.compile(r'```[a-zA-Z]*[ \t]*\n(.*?)```', re.DOTALL)
+_OBJECT_START = re.compile(r'\{\s*["}]')
+_HIDDEN_OBJECT = re.compile(r'\{\s*"$')
+# Each rescan can read to the end of the text, so only the first few are tried.
+_MAX_RESCANS = 16
+# json.loads raises RecursionError on objects nested about this deep, so deeper spans
+# are only searched for nested ones.
+_MAX_DEPTH = 500
+# Each span is handed to json.loads as its own slice, and nested spans overlap, so the
+# slices may add up to at most this many times the text's length.
+_PARSE_BUDGET = 4
+
+def _object_spans(text):
+    """(start, end) of every balanced {...} in text, ignoring braces inside strings,
+    in order of start."""
+    spans = []
+    stack = []
+    for match in _JSON_TOKEN.finditer(text):
+        token = match.group()
+        if token == '{':
+            stack.append(match.start())
+        elif token == '}' and stack:
+            spans.append((stack.pop(), match.end()))
+    spans.sort()
+    return spans
+
+def _quoted_braces(text):
+    """Positions of '{' that the scan read as the end of a string. An unmatched quote
+    in prose pairs with the first key's quote of an object later on the same line,
+    so the string swallows that object's opening brace."""
+    return [match.start() + hidden.start()
+            for match in _JSON_TOKEN.finditer(text)
+            for hidden in [_HIDDEN_OBJECT.search(match.group())] if hidden]
+
+def _span_from(text, start):
+    """End of the balanced {...} that opens at start, scanning only as far as it reaches."""
+    depth = 0
+    for match in _JSON_TOKEN.finditer(text, start):
+        token = match.group()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return None
+
+def _first_dict(value, key):
+    """The first dict in a parsed value, in document order, holding key when given."""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if key is None or key in value:
+                return value
+            stack.extend(reversed(list(value.values())))
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
+    return None
+
+def _first_object(text, spans, key):
+    """The first outermost span that parses to a dict (holding key, when given);
+    spans that do not qualify are searched for a nested one instead."""
+    # after[i]: index of the first span past span i and everything nested in it;
+    # height[i]: how many levels of spans are nested in span i.
+    after = [len(spans)] * len(spans)
+    parents = [None] * len(spans)
+    open_spans = []
+    for j, (start, _) in enumerate(spans):
+        while open_spans and spans[open_spans[-1]][1] <= start:
+            after[open_spans.pop()] = j
+        if open_spans:
+            parents[j] = open_spans[-1]
+        open_spans.append(j)
+    height = [0] * len(spans)
+    for j in reversed(range(len(spans))):
+        if parents[j] is not None:
+            height[parents[j]] = max(height[parents[j]], height[j] + 1)
+
+    budget = _PARSE_BUDGET * len(text)
+    # Stack of [first, stop) ranges of sibling spans still to visit, with the position
+    # the innermost enclosing span that failed to parse stopped at.
+    pending = [(0, len(spans), None)]
+    while pending:
+        i, stop, failed_at = pending.pop()
+        if i >= stop:
+            continue
+        start, end = spans[i]
+        children = after[i]
+        pending.append((children, stop, failed_at))
+        # A span around the position its parent stopped at was read the same way
+        # there and fails too, so only the spans nested in it are tried.
+        if (failed_at is not None and start < failed_at < end) or height[i] > _MAX_DEPTH \
+                or end - start > budget or not _OBJECT_START.match(text, start):
+            pending.append((i + 1, children, failed_at))
+            continue
+        budget -= end - start
+        # Parse a slice: a decode error on the full text would count lines from its start.
+        try:
+            value = _first_dict(json.loads(text[start:end]), key)
+        except json.JSONDecodeError as e:
+            # "Extra data" means the parse ended early, not that it stopped inside a span.
+            pending.append((i + 1, children, None if e.msg == "Extra data" else start + e.pos))
+            continue
+        except (ValueError, RecursionError):
+            pending.append((i + 1, children, None))
+            continue
+        # Every object nested in the span was parsed with it.
+        if value is not None:
+            return value
+    return None
 
 class Utils:
     @staticmethod
-    def extractValidJson(input_str):
+    def extractValidJson(input_str, key=None):
+        """The first JSON object in a model response, or None. Code fences are looked
+        in first; with key, only an object that has that key counts (so a stray
+        example object does not shadow the answer). One pass over the text finds
+        every balanced, string-aware {...}; outermost objects are tried first. If
+        none parses, an unmatched quote in prose may have hidden the object, so
+        the scan restarts from braces it had read as the end of a string."""
         try:
-            return json.loads(input_str)
-        except json.JSONDecodeError:
-            json_pattern = re.compile(r'.*\{[\S\s]*\}')
-            match = json_pattern.search(input_str)
-            if match:
-                json_str = match.group(0)
-                try:
-                    return json.loads(json_str)
-                except json.JSONDecodeError:
-                    print("Unable to parse the JSON part from the input string.")
-                    return None
-            else:
-                print("No valid JSON part found in the input string.")
-                return None
+            value = json.loads(input_str)
+            if isinstance(value, dict) and (key is None or key in value):
+                return value
+        except (ValueError, RecursionError):
+            pass
+
+        texts = [m.group(1) for m in _CODE_FENCE.finditer(input_str)] + [input_str]
+        for text in texts:
+            value = _first_object(text, _object_spans(text), key)
+            if value is not None:
+                return value
+
+        # Nothing parsed: rescan from each brace a stray quote may have hidden.
+        for text in texts:
+            for start in _quoted_braces(text)[:_MAX_RESCANS]:
+                end = _span_from(text, start)
+                if end is not None:
+                    candidate = text[start:end]
+                    value = _first_object(candidate, _object_spans(candidate), key)
+                    if value is not None:
+                        return value
+        print("No valid JSON part found in the input string.")
+        return None
+
+    @staticmethod
+    def text_fingerprint(text):
+        """Hash of the text with case, punctuation and whitespace differences removed."""
+        normalized = ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def content_id(text):
+        """Stable entry id derived from the fact itself, so re-ingesting it is idempotent."""
+        return f"fact-{Utils.text_fingerprint(text)[:16]}"
+
+    @staticmethod
+    def file_fingerprint(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
 
     @staticmethod
     def get_current_timestamp():
         return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
     @staticmethod
-    def format_chroma_results(chroma_results):
+    def format_chroma_results(chroma_results, query_index=0):
         formatted_results = []
-        num_results = len(chroma_results['ids'][0])
+        q = query_index
+        num_results = len(chroma_results['ids'][q])
         for i in range(num_results):
             item = {
-                'id': chroma_results['ids'][0][i],
-                'distance': chroma_results['distances'][0][i] if chroma_results['distances'] else None,
-                'metadata': chroma_results['metadatas'][0][i] if chroma_results['metadatas'] else None,
-                'document': chroma_results['documents'][0][i] if chroma_results['documents'] else None,
-                'embedding': chroma_results['embeddings'][0][i] if chroma_results['embeddings'] else None
+                'id': chroma_results['ids'][q][i],
+                'distance': chroma_results['distances'][q][i] if chroma_results['distances'] else None,
+                'metadata': chroma_results['metadatas'][q][i] if chroma_results['metadatas'] else None,
+                'document': chroma_results['documents'][q][i] if chroma_results['documents'] else None,
+                'embedding': chroma_results['embeddings'][q][i] if chroma_results['embeddings'] else None
             }
             formatted_results.append(item)
         return formatted_results
+
+    @staticmethod
+    def parallel_map(func, items, max_workers=4):
+        """Apply func to every item on at most max_workers threads; results keep the input order."""
+        items = list(items)
+        if max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        results = dict(Utils.bounded_map(func, items, max_workers))
+        return [results[index] for index in range(len(items))]
+
+    @staticmethod
+    def call_with_retries(func, *args, retries=0, backoff=1.0, on_retry=None):
+        """func(*args), called again up to retries times when it raises, waiting
+        backoff * 2 ** attempt seconds first; on_retry(error) runs before each wait.
+        The last error is raised."""
+        for attempt in range(retries + 1):
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                if on_retry is not None:
+                    on_retry(e)
+                time.sleep(backoff * 2 ** attempt)
+
+    @staticmethod
+    def bounded_map(func, items, max_workers=4, retries=0, backoff=1.0, on_retry=None, on_failure=None):
+        """Yield (index, func(item)) as each call finishes, with at most max_workers
+        calls running. Items are pulled from the iterable only as workers free up,
+        so a lazy producer stays just ahead of the calls. A call that raises is
+        retried as in call_with_retries, reporting on_retry(index, error); once the
+        retries run out, on_failure(index, error) gives the result, or the error is
+        raised when there is no on_failure."""
+        def run(index, item):
+            try:
+                return Utils.call_with_retries(func, item, retries=retries, backoff=backoff,
+                                               on_retry=on_retry and (lambda e: on_retry(index, e)))
+            except Exception as e:
+                if on_failure is None:
+                    raise
+                return on_failure(index, e)
+
+        max_workers = max(1, max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {}
+            for index, item in enumerate(items):
+                in_flight[executor.submit(run, index, item)] = index
+                if len(in_flight) >= max_workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield in_flight.pop(future), future.result()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
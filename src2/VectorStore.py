@@ -0,0 +1,336 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from abc import ABC, abstractmethod
+
+class VectorStore(ABC):
+    """Storage backend behind MemoryManager. Implementations follow the subset of the
+    Chroma collection API the manager uses (argument names and result shapes), so
+    the manager code does not depend on which backend is active.
+
+    Distances are squared L2, as in Chroma's default "l2" space."""
+
+    @abstractmethod
+    def add(self, ids, documents, metadatas, embeddings=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, ids, documents=None, metadatas=None, embeddings=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, include=("metadatas", "documents", "distances")):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, ids=None, limit=None, offset=None, include=("metadatas", "documents")):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, ids):
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self):
+        """Remove every entry at once."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def refresh(self):
+        """Reload after another process has written to the store."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self):
+        raise NotImplementedError
+
+class ChromaStore(VectorStore):
+    """The default backend: a persistent Chroma collection."""
+
+    def __init__(self, db_path, collection_name, embedding_function):
+        import chromadb
+
+        self.client = chromadb.PersistentClient(path=db_path)
+        self.db_path = db_path
+        self.collection_name = collection_name
+        self.embedding_function = embedding_function
+        self.collection = self.client.get_or_create_collection(collection_name, embedding_function=embedding_function)
+        # Calls in flight on the collection; refresh() waits for none before it swaps
+        # out the segments they may be reading.
+        self._calls = 0
+        self._idle = threading.Condition()
+
+    @contextmanager
+    def _call(self):
+        with self._idle:
+            self._calls += 1
+        try:
+            yield self.collection
+        finally:
+            with self._idle:
+                self._calls -= 1
+                self._idle.notify_all()
+
+    def add(self, ids, documents, metadatas, embeddings=None):
+        with self._call() as collection:
+            collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def update(self, ids, documents=None, metadatas=None, embeddings=None):
+        with self._call() as collection:
+            collection.update(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, include=("metadatas", "documents", "distances")):
+        with self._call() as collection:
+            return collection.query(query_texts=query_texts, query_embeddings=query_embeddings,
+                                    n_results=n_results, include=list(include))
+
+    def get(self, ids=None, limit=None, offset=None, include=("metadatas", "documents")):
+        with self._call() as collection:
+            return collection.get(ids=ids, limit=limit, offset=offset, include=list(include))
+
+    def delete(self, ids):
+        with self._call() as collection:
+            collection.delete(ids=ids)
+
+    def clear(self):
+        # Dropping the collection is one operation; deleting its ids is one per row.
+        with self._idle:
+            self._idle.wait_for(lambda: self._calls == 0)
+            self.client.delete_collection(self.collection_name)
+            self.collection = self.client.get_or_create_collection(self.collection_name,
+                                                                   embedding_function=self.embedding_function)
+
+    def refresh(self):
+        # Chroma keeps each collection's vector index in memory and only feeds it
+        # writes made through this process. Dropping this collection's segments makes
+        # the next call load them again from disk, where other processes' writes are;
+        # the rest of the client, and any other client in the process, is untouched.
+        from chromadb.types import SegmentScope
+
+        with self._idle:
+            self._idle.wait_for(lambda: self._calls == 0)
+            server = self.client._server
+            manager = server._manager
+            collection_id = self.collection.id
+            with manager._lock:
+                for scope in (SegmentScope.VECTOR, SegmentScope.METADATA):
+                    segment = manager.segment_cache[scope].pop(collection_id)
+                    instance = segment and manager._instances.pop(segment["id"], None)
+                    if instance is not None:
+                        instance.stop()
+                manager._vector_instances_file_handle_cache.cache.pop(collection_id, None)
+            server._collection_cache.pop(collection_id, None)
+            # Another process may have dropped and recreated the collection under a new id.
+            self.collection = self.client.get_or_create_collection(self.collection_name,
+                                                                   embedding_function=self.embedding_function)
+
+    def count(self):
+        with self._call() as collection:
+            return collection.count()
+
+class NumpyStore(VectorStore):
+    """In-process backend for small and medium knowledge bases: a float32 matrix of
+    unit-normalized embeddings searched with one matrix product and argpartition.
+
+    On disk, vectors.f32 holds the raw rows and is memory-mapped on load, and
+    records.jsonl holds one [id, document, metadata] line per row. Adds append
+    to both files. Updates rewrite vectors in place. Deletes compact the files, so
+    removing everything goes through clear(), which truncates them once."""
+
+    VECTORS = "vectors.f32"
+    RECORDS = "records.jsonl"
+
+    def __init__(self, path, embedding_function):
+        import numpy as np
+
+        self.np = np
+        self.path = path
+        self.embedding_function = embedding_function
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        self._ids, self._documents, self._metadatas = [], [], []
+        records_path = os.path.join(self.path, self.RECORDS)
+        if os.path.exists(records_path):
+            with open(records_path) as f:
+                for line in f:
+                    if line.strip():
+                        id, document, metadata = json.loads(line)
+                        self._ids.append(id)
+                        self._documents.append(document)
+                        self._metadatas.append(metadata)
+        self._index = {id: i for i, id in enumerate(self._ids)}
+        self._load_vectors()
+
+    def _load_vectors(self):
+        np = self.np
+        vectors_path = os.path.join(self.path, self.VECTORS)
+        n = len(self._ids)
+        if n == 0 or not os.path.exists(vectors_path):
+            self._vectors = None
+            return
+        dim = os.path.getsize(vectors_path) // (4 * n)
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(n, dim))
+
+    def _normalize(self, embeddings):
+        np = self.np
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return matrix / norms
+
+    def _embed(self, documents, embeddings):
+        if embeddings is None:
+            embeddings = self.embedding_function(list(documents))
+        matrix = self._normalize(embeddings)
+        # Rows are read back by file size, so one row of another width corrupts them all.
+        if self._vectors is not None and matrix.shape[1] != self._vectors.shape[1]:
+            raise ValueError(f"Embedding width {matrix.shape[1]} does not match the store's "
+                             f"{self._vectors.shape[1]}")
+        return matrix
+
+    def _write_records(self):
+        records_path = os.path.join(self.path, self.RECORDS)
+        with open(records_path + ".tmp", "w") as f:
+            for row in zip(self._ids, self._documents, self._metadatas):
+                f.write(json.dumps(row) + "\n")
+        os.replace(records_path + ".tmp", records_path)
+
+    def add(self, ids, documents, metadatas, embeddings=None):
+        with self._lock:
+            # Chroma ignores ids that already exist; do the same.
+            keep = [i for i, id in enumerate(ids) if id not in self._index]
+            if not keep:
+                return
+            ids = [ids[i] for i in keep]
+            documents = [documents[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+            if embeddings is not None:
+                embeddings = [embeddings[i] for i in keep]
+            matrix = self._embed(documents, embeddings)
+
+            with open(os.path.join(self.path, self.VECTORS), "ab") as f:
+                f.write(matrix.tobytes())
+            with open(os.path.join(self.path, self.RECORDS), "a") as f:
+                for row in zip(ids, documents, metadatas):
+                    f.write(json.dumps(row) + "\n")
+
+            for id, document, metadata in zip(ids, documents, metadatas):
+                self._index[id] = len(self._ids)
+                self._ids.append(id)
+                self._documents.append(document)
+                self._metadatas.append(metadata)
+            self._load_vectors()
+
+    def update(self, ids, documents=None, metadatas=None, embeddings=None):
+        np = self.np
+        with self._lock:
+            rows = [self._index[id] for id in ids if id in self._index]
+            known = [i for i, id in enumerate(ids) if id in self._index]
+            if not rows:
+                return
+            for position, row in zip(known, rows):
+                if documents is not None:
+                    self._documents[row] = documents[position]
+                if metadatas is not None:
+                    self._metadatas[row] = metadatas[position]
+
+            if documents is not None or embeddings is not None:
+                matrix = self._embed(
+                    [self._documents[row] for row in rows],
+                    None if embeddings is None else [embeddings[i] for i in known]
+                )
+                vectors = np.memmap(os.path.join(self.path, self.VECTORS), dtype=np.float32, mode='r+',
+                                    shape=self._vectors.shape)
+                vectors[rows] = matrix
+                vectors.flush()
+                del vectors
+                self._load_vectors()
+            self._write_records()
+
+    def delete(self, ids):
+        np = self.np
+        with self._lock:
+            doomed = {self._index[id] for id in ids if id in self._index}
+            if not doomed:
+                return
+            keep = [i for i in range(len(self._ids)) if i not in doomed]
+            vectors = np.array(self._vectors[keep]) if keep else None
+            self._ids = [self._ids[i] for i in keep]
+            self._documents = [self._documents[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._index = {id: i for i, id in enumerate(self._ids)}
+
+            self._vectors = None
+            vectors_path = os.path.join(self.path, self.VECTORS)
+            with open(vectors_path + ".tmp", "wb") as f:
+                if vectors is not None:
+                    f.write(vectors.tobytes())
+            os.replace(vectors_path + ".tmp", vectors_path)
+            self._write_records()
+            self._load_vectors()
+
+    def refresh(self):
+        with self._lock:
+            self._load()
+
+    def clear(self):
+        with self._lock:
+            self._ids, self._documents, self._metadatas = [], [], []
+            self._index = {}
+            self._vectors = None
+            for name in (self.VECTORS, self.RECORDS):
+                open(os.path.join(self.path, name), "w").close()
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, include=("metadatas", "documents", "distances")):
+        np = self.np
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(list(query_texts))
+        queries = self._normalize(query_embeddings)
+
+        with self._lock:
+            results = {key: [] for key in ("ids", "distances", "documents", "metadatas", "embeddings")}
+            k = min(n_results, len(self._ids))
+            if k == 0:
+                top = np.empty((len(queries), 0), dtype=np.int64)
+                similarities = np.empty((len(queries), 0), dtype=np.float32)
+            else:
+                similarities = queries @ self._vectors.T
+                top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+                order = np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1)
+                top = np.take_along_axis(top, order, axis=1)
+
+            for q, rows in enumerate(top):
+                rows = rows.tolist()
+                results["ids"].append([self._ids[i] for i in rows])
+                # Squared L2 between unit vectors, matching Chroma's "l2" space.
+                results["distances"].append([float(2 - 2 * similarities[q, i]) for i in rows])
+                results["documents"].append([self._documents[i] for i in rows])
+                results["metadatas"].append([self._metadatas[i] for i in rows])
+                if "embeddings" in include:
+                    results["embeddings"].append([self._vectors[i].tolist() for i in rows])
+
+        return {key: (value if key in include or key == "ids" else None) for key, value in results.items()}
+
+    def get(self, ids=None, limit=None, offset=None, include=("metadatas", "documents")):
+        with self._lock:
+            if ids is None:
+                rows = list(range(len(self._ids)))
+            else:
+                rows = [self._index[id] for id in ids if id in self._index]
+            start = offset or 0
+            rows = rows[start:start + limit if limit is not None else None]
+            return {
+                "ids": [self._ids[i] for i in rows],
+                "documents": [self._documents[i] for i in rows] if "documents" in include else None,
+                "metadatas": [self._metadatas[i] for i in rows] if "metadatas" in include else None,
+                "embeddings": [self._vectors[i].tolist() for i in rows] if "embeddings" in include else None
+            }
+
+    def count(self):
+        return len(self._ids)
@@ -1,25 +1,50 @@
 import tornado.ioloop
+import tornado.iostream
+import tornado.queues
 import tornado.web
 import json
-from FormFillerConsole import FormFillerInterface
-from KnowledgeConsole import ConsoleInterface
-from Memory import MemoryManager
-from Preprocess import Preprocessor
-from openai import OpenAI
-from AnalyzeFormHandler import SimplifiedWebFormProcessor
+import argparse
+import threading
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Initialize components
-api_key = os.getenv('OPENAI_API_KEY')
-openai_client = OpenAI(api_key=api_key)
-memory_manager = MemoryManager(api_key)
-preprocessor = Preprocessor(api_key)
-form_filler = FormFillerInterface(openai_client, memory_manager, preprocessor)
-knowledge_console = ConsoleInterface(memory_manager, preprocessor)
-simplifiedWebFormProcessor = SimplifiedWebFormProcessor(openai_client, memory_manager, form_filler)
+# Components are built on the first request that needs them, so the server can
+# answer "/" and "/chat help" without importing openai, chromadb, pandas or rich.
+_components = None
+_components_lock = threading.Lock()
+
+def components():
+    global _components
+    if _components is None:
+        with _components_lock:
+            if _components is None:
+                from openai import OpenAI
+                from FormFillerConsole import FormFillerInterface
+                from KnowledgeConsole import ConsoleInterface
+                from Memory import MemoryManager
+                from Preprocess import Preprocessor
+                from AnalyzeFormHandler import SimplifiedWebFormProcessor
+                from Registry import IngestRegistry
+
+                api_key = os.getenv('OPENAI_API_KEY')
+                openai_client = OpenAI(api_key=api_key)
+                registry = IngestRegistry()
+                memory_manager = MemoryManager(api_key, registry=registry)
+                preprocessor = Preprocessor(api_key, registry)
+                form_filler = FormFillerInterface(openai_client, memory_manager, preprocessor)
+                _components = {
+                    "memory_manager": memory_manager,
+                    "form_filler": form_filler,
+                    "knowledge_console": ConsoleInterface(memory_manager, preprocessor, registry),
+                    "simplifiedWebFormProcessor": SimplifiedWebFormProcessor(openai_client, memory_manager, form_filler)
+                }
+    return _components
+
+def warm_up():
+    components()['memory_manager'].warm_up()
+    print("Warm-up complete")
 
 class MainHandler(tornado.web.RequestHandler):
     def get(self):
@@ -35,33 +60,71 @@ class UploadDocumentHandler(tornado.web.RequestHandler):
             with open(filename, 'wb') as f:
                 f.write(content)
             
-            knowledge_console.process_file_command(f"{filename} {comment}")
+            components()['knowledge_console'].process_file_command(f"{filename} {comment}")
             os.remove(filename)
         self.write({"status": "success", "response": f"Processed {len(files)} documents"})
 
 class AnalyzeFormHandler(tornado.web.RequestHandler):
     def post(self):
         data = json.loads(self.request.body)
-        filled_form = simplifiedWebFormProcessor.process(data)
+        filled_form = components()['simplifiedWebFormProcessor'].process(data)
         self.write({"fieldValues": filled_form})
 
+class AnalyzeFormStreamHandler(tornado.web.RequestHandler):
+    """/analyze-form answered in JSON lines: one {"batch", "batches", "fieldValues"}
+    line per batch as soon as it is filled, then a {"done": true} line."""
+
+    async def post(self):
+        data = json.loads(self.request.body)
+        self.set_header("Content-Type", "application/x-ndjson")
+        self.set_header("Cache-Control", "no-cache")
+
+        # Filling blocks, so it runs on its own thread and hands lines to the IOLoop.
+        loop = tornado.ioloop.IOLoop.current()
+        events = tornado.queues.Queue()
+
+        def fill():
+            batches = 0
+            try:
+                for index, batches, field_values in components()['simplifiedWebFormProcessor'].iter_process(data):
+                    loop.add_callback(events.put, {"batch": index, "batches": batches, "fieldValues": field_values})
+                loop.add_callback(events.put, {"done": True, "batches": batches})
+            except Exception as e:
+                loop.add_callback(events.put, {"done": True, "batches": batches, "error": str(e)})
+
+        threading.Thread(target=fill, daemon=True).start()
+        while True:
+            event = await events.get()
+            try:
+                self.write(json.dumps(event) + "\n")
+                await self.flush()
+            except tornado.iostream.StreamClosedError:
+                return
+            if event.get("done"):
+                break
+
 class ChatHandler(tornado.web.RequestHandler):
     def post(self):
         data = json.loads(self.request.body)
         message = data['message']
+        self.next_offset = None
         response = self.process_chat_command(message)
-        self.write({"response": response})
+        reply = {"response": response}
+        if self.next_offset is not None:
+            reply["next_offset"] = self.next_offset
+        self.write(reply)
 
     def process_chat_command(self, message):
         command = message.strip().split(maxsplit=1)
         if command[0] == "help":
             return self.get_help_text()
         elif command[0] == "all":
-            return self.get_all_memories()
+            offset = int(command[1]) if len(command) == 2 and command[1].isdigit() else 0
+            return self.get_all_memories(offset)
         elif command[0] == "search" and len(command) == 2:
             return self.search_memories(command[1])
         elif command[0] == "update" and len(command) == 2:
-            knowledge_console.process_update_command(command[1])
+            components()['knowledge_console'].process_update_command(command[1])
             return "Updated knowledge base."
         elif command[0] == "del_id" and len(command) == 2:
             return self.delete_memory(command[1])
@@ -72,22 +135,26 @@ class ChatHandler(tornado.web.RequestHandler):
         return """
         Available commands:
         - help: Display this help message
-        - all: Display all memories
+        - all [offset]: Display memories, one page at a time
         - search <query>: Search the knowledge base
         - update <info>: Directly update knowledge base
         - del <query>: Delete a memory
         """
 
-    def get_all_memories(self):
-        memories = knowledge_console.memory_manager.get_all_memories()
-        return memories.to_json(orient='records')
+    def get_all_memories(self, offset=0, page_size=100):
+        memory_manager = components()['memory_manager']
+        records, self.next_offset = memory_manager.get_memories_page(page_size, offset)
+        return json.dumps([
+            {'ID': record.id, 'Document': record.document, 'Metadata': memory_manager.format_metadata(record.metadata)}
+            for record in records
+        ])
 
     def search_memories(self, query):
-        results = knowledge_console.memory_manager.search_memories(query)
-        return results.to_json(orient='records')
+        records = components()['memory_manager'].search_records(query)
+        return json.dumps([record.to_dict() for record in records])
 
     def delete_memory(self, memory_id):
-        if knowledge_console.memory_manager.delete_entry(memory_id):
+        if components()['memory_manager'].delete_entry(memory_id):
             return f"Deleted memory with ID: {memory_id}"
         return "No matching memory found to delete."
 
@@ -95,12 +162,20 @@ def make_app():
     return tornado.web.Application([
         (r"/", MainHandler),
         (r"/analyze-form", AnalyzeFormHandler),
+        (r"/analyze-form/stream", AnalyzeFormStreamHandler),
         (r"/upload", UploadDocumentHandler),
         (r"/chat", ChatHandler),
     ])
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Form Filler and Knowledge Base Server")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--warmup", action="store_true", help="load models and the knowledge base in the background at startup")
+    args = parser.parse_args()
+
     app = make_app()
-    app.listen(8888)
-    print("Server started at http://localhost:8888")
+    app.listen(args.port)
+    print(f"Server started at http://localhost:{args.port}")
+    if args.warmup:
+        threading.Thread(target=warm_up, daemon=True).start()
     tornado.ioloop.IOLoop.current().start()